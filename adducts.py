@@ -0,0 +1,256 @@
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, TextIO, Union
+
+import numpy as np
+
+import export
+import isomol
+
+# The ions commonly observed in positive and negative electrospray ionization
+POSITIVE = ["[M+H]+", "[M+Na]+", "[M+K]+", "[M+NH4]+", "[M+2H]2+"]
+NEGATIVE = ["[M-H]-", "[M+Cl]-", "[M+HCOO]-", "[M-2H]2-"]
+
+_ADDUCT = re.compile(r"\[(\d*)M((?:[+-]\d*[A-Za-z0-9()]+)*)\](\d*)([+-]?)")
+_TERM = re.compile(r"([+-])(\d*)([A-Za-z0-9()]+)")
+
+
+class Adduct(NamedTuple):
+    """
+    The definition of an ion species, e.g. `[M+Na]+` or `[2M-H]-`.
+
+    Attributes
+    ----------
+    name: str
+        The name of the species.
+    multiplicity: int
+        The number of molecules M contained in the ion.
+    delta: Dict[str, int]
+        The number of atoms of each element added (or removed if negative) to the molecules.
+    charge: int
+        The charge of the ion.
+    """
+
+    name: str
+    multiplicity: int
+    delta: Dict[str, int]
+    charge: int
+
+
+class Ion(NamedTuple):
+    """
+    The isotope pattern of an ion species.
+
+    Attributes
+    ----------
+    species: str
+        The name of the ion species.
+    formula: str
+        The canonical formula of the ion.
+    charge: int
+        The charge of the ion.
+    peaks: np.ndarray
+        The (peaks, 2) array with the m/z and the intensity of each peak, sorted by m/z.
+    """
+
+    species: str
+    formula: str
+    charge: int
+    peaks: np.ndarray
+
+
+def parse_adduct(name: str) -> Adduct:
+    """
+    Parse the name of an ion species in the usual `[nM+A-B]z+` notation, in which each
+    added or removed group can be preceded by a multiplier (e.g. `[M+2H]2+`).
+
+    Arguments
+    ---------
+    name: str
+        The name of the ion species.
+
+    Returns
+    -------
+    Adduct
+        The definition of the species.
+    """
+    match = _ADDUCT.fullmatch(name.replace(" ", ""))
+    if match is None:
+        raise ValueError(f"Invalid ion species '{name}'")
+
+    multiplicity, terms, number, sign = match.groups()
+
+    delta = {}
+    for operation, multiplier, group in _TERM.findall(terms):
+        factor = (1 if operation == "+" else -1) * int(multiplier or 1)
+        for element, count in isomol.parse_formula(group):
+            delta[element] = delta.get(element, 0) + factor * count
+
+    charge = int(number or 1) if sign else 0
+    return Adduct(
+        name, int(multiplicity or 1), delta, -charge if sign == "-" else charge
+    )
+
+
+def adduct_patterns(
+    composition: List[List[Union[str, int]]],
+    adducts: Sequence[Union[str, Adduct]] = POSITIVE,
+    normalize: bool = False,
+    table: Optional[isomol.IsotopeTable] = None,
+    **options,
+) -> List[Ion]:
+    """
+    Compute the m/z patterns of several ion species of a molecule reusing a single pattern.
+    The pattern of the largest composition shared by all the species (the neutral molecule
+    if no atom is removed) is computed once and the small pattern of the atoms that each
+    species adds to it is convolved in. The masses are then converted to m/z correcting for
+    the mass of the electrons removed or added.
+
+    Arguments
+    ---------
+    composition: List[List[Union[str, int]]]
+        The composition of the neutral molecule M.
+    adducts: Sequence[Union[str, Adduct]]
+        The ion species to compute (default: the common positive ESI ions).
+    normalize: bool
+        If set to True the largest peak of each species is set to 100.
+    table: Optional[isomol.IsotopeTable]
+        The isotope table to use. If None the default one is used.
+    **options
+        The keyword arguments passed to `isomol.process` and `isomol.extend`
+        (`equivalent`, `dump`, `coverage`, `max_peaks`, etc.).
+
+    Returns
+    -------
+    List[Ion]
+        The patterns of the ion species in the order in which they are given.
+    """
+    adducts = [parse_adduct(a) if isinstance(a, str) else a for a in adducts]
+
+    molecule = {}
+    for element, number in composition:
+        molecule[element] = molecule.get(element, 0) + number
+
+    targets = []
+    for adduct in adducts:
+        counts = {e: adduct.multiplicity * n for e, n in molecule.items()}
+        for element, number in adduct.delta.items():
+            counts[element] = counts.get(element, 0) + number
+
+        if any(number < 0 for number in counts.values()):
+            raise ValueError(
+                f"The molecule does not contain the atoms removed by {adduct.name}"
+            )
+        targets.append(counts)
+
+    # The atoms contained in all the ions form the core, whose pattern is computed once.
+    # The core and its extension to each ion retain each the square root of the coverage
+    # so that the pattern of every ion retains at least `coverage` of its probability
+    coverage = options.pop("coverage", 1.0)
+    if not 0 < coverage <= 1:
+        raise ValueError("The coverage must be in the (0, 1] interval")
+
+    core = {e: min(counts.get(e, 0) for counts in targets) for e in targets[0]}
+    core = {e: n for e, n in core.items() if n > 0}
+    core_peaks = None
+    if core:
+        core_peaks = isomol.process(
+            list(map(list, core.items())),
+            table=table,
+            coverage=coverage**0.5,
+            **options,
+        )
+
+    # The species adding the same atoms to the core share the same pattern
+    residuals, ions = {}, []
+    for adduct, counts in zip(adducts, targets):
+        residual = [
+            [e, counts[e] - core.get(e, 0)]
+            for e in isomol.hill_order(counts)
+            if counts[e] > core.get(e, 0)
+        ]
+
+        key = isomol.format_formula(residual)
+        if key not in residuals:
+            if residual == []:
+                residuals[key] = core_peaks
+            elif core_peaks is None:
+                residuals[key] = isomol.process(
+                    residual, table=table, coverage=coverage, **options
+                )
+            else:
+                residuals[key] = isomol.extend(
+                    core_peaks, residual, table=table, coverage=coverage**0.5, **options
+                )
+
+        peaks = np.array(residuals[key], dtype=float).reshape(-1, 2)
+        ions.append(
+            Ion(
+                adduct.name,
+                isomol.format_formula(list(counts.items()), adduct.charge),
+                adduct.charge,
+                to_mz(peaks, adduct.charge, normalize),
+            )
+        )
+
+    return ions
+
+
+def to_mz(peaks: np.ndarray, charge: int, normalize: bool = False) -> np.ndarray:
+    """
+    Convert the masses of a (peaks, 2) array of neutral masses and intensities to the m/z
+    of the ion obtained removing (or adding) `charge` electrons, sorting the peaks by m/z.
+    """
+    peaks = peaks[np.argsort(peaks[:, 0])]
+    if charge != 0:
+        peaks[:, 0] = (peaks[:, 0] - charge * isomol.ELECTRON_MASS) / abs(charge)
+
+    if normalize and peaks.size != 0:
+        peaks[:, 1] *= 100 / peaks[:, 1].max()
+
+    return peaks
+
+
+def format_table(ions: List[Ion], threshold: float = 0.0) -> str:
+    """
+    Format the patterns of the ion species as a single table grouped by species, listing
+    only the peaks with intensity at least `threshold` times the largest one of the species.
+    """
+    lines = [f"{'Species':>12} | {'Formula':>16} | {'m/z':>12} | Intensity", "-" * 60]
+    for ion in ions:
+        maximum = ion.peaks[:, 1].max() if ion.peaks.size else 0
+        for mz, intensity in ion.peaks.tolist():
+            if intensity >= threshold * maximum:
+                lines.append(
+                    f"{ion.species:>12} | {ion.formula:>16} | {mz:>12.6f} | {intensity:.4e}"
+                )
+
+    return "\n".join(lines)
+
+
+def save(path: str, ions: List[Ion]) -> None:
+    """
+    Save the patterns of the ion species choosing the format from the path: CSV for
+    `.csv` files, otherwise a library (see the `export` module) containing the pattern
+    of each species under its name.
+    """
+    if path.endswith(".csv"):
+        with open(path, "w", buffering=1024**2) as stream:
+            write_csv(stream, ions)
+    else:
+        with export.LibraryWriter(path) as writer:
+            for ion in ions:
+                writer.add(ion.species, ion.peaks.tolist())
+
+
+def write_csv(stream: TextIO, ions: List[Ion]) -> None:
+    """
+    Write the patterns of the ion species as CSV lines (species, m/z, intensity).
+    """
+    stream.write("species,mz,intensity\n")
+    for ion in ions:
+        stream.write(
+            "".join(
+                f"{ion.species},{mz:.10f},{intensity:.10e}\n"
+                for mz, intensity in ion.peaks.tolist()
+            )
+        )
@@ -23,11 +23,18 @@ class Ui_MainWindow(object):
         self.peakBox = QtWidgets.QGroupBox(self.centralwidget)
         self.peakBox.setGeometry(QtCore.QRect(1020, 80, 241, 501))
         self.peakBox.setObjectName("peakBox")
-        self.tableWidget = QtWidgets.QTableWidget(self.peakBox)
-        self.tableWidget.setGeometry(QtCore.QRect(10, 30, 221, 451))
-        self.tableWidget.setObjectName("tableWidget")
-        self.tableWidget.setColumnCount(0)
-        self.tableWidget.setRowCount(0)
+        self.tableView = QtWidgets.QTableView(self.peakBox)
+        self.tableView.setGeometry(QtCore.QRect(10, 60, 221, 421))
+        self.tableView.setObjectName("tableView")
+        self.thresholdLabel = QtWidgets.QLabel(self.peakBox)
+        self.thresholdLabel.setGeometry(QtCore.QRect(10, 30, 121, 25))
+        self.thresholdLabel.setObjectName("thresholdLabel")
+        self.thresholdSpinBox = QtWidgets.QDoubleSpinBox(self.peakBox)
+        self.thresholdSpinBox.setGeometry(QtCore.QRect(140, 30, 91, 25))
+        self.thresholdSpinBox.setDecimals(4)
+        self.thresholdSpinBox.setMaximum(100.0)
+        self.thresholdSpinBox.setSingleStep(0.1)
+        self.thresholdSpinBox.setObjectName("thresholdSpinBox")
         self.label = QtWidgets.QLabel(self.centralwidget)
         self.label.setGeometry(QtCore.QRect(30, 10, 91, 17))
         self.label.setObjectName("label")
@@ -60,8 +67,9 @@ class Ui_MainWindow(object):
         _translate = QtCore.QCoreApplication.translate
         MainWindow.setWindowTitle(_translate("MainWindow", "IsoMol"))
         self.peakBox.setTitle(_translate("MainWindow", "Peaks:"))
+        self.thresholdLabel.setText(_translate("MainWindow", "Threshold (%):"))
         self.label.setText(_translate("MainWindow", "Brute formula:"))
         self.computeButton.setText(_translate("MainWindow", "Compute"))
         self.saveButton.setText(_translate("MainWindow", "Save .png"))
-        self.exportButton.setText(_translate("MainWindow", "Export .csv"))
+        self.exportButton.setText(_translate("MainWindow", "Export..."))
         self.YLogscaleCheckBox.setText(_translate("MainWindow", "Use logscale Y"))
@@ -0,0 +1,370 @@
+import csv
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, TextIO
+
+import isomol
+import resultcache
+
+CSV_FIELDS = ["formula", "error", "masses", "intensities"]
+
+# Columnar binary formats, written by `export.LibraryWriter` (requires numpy)
+BINARY_FORMATS = ["npz", "npy"]
+
+
+def read_formulas(stream: Iterable[str]) -> Iterator[str]:
+    """
+    Read the brute formulas from a text stream containing one formula per line. Empty lines
+    and lines starting with `#` are skipped.
+
+    Arguments
+    ---------
+    stream: Iterable[str]
+        The stream of lines (e.g. an open file or `sys.stdin`).
+
+    Returns
+    -------
+    Iterator[str]
+        The iterator over the formulas.
+    """
+    for line in stream:
+        formula = line.strip()
+        if formula and not formula.startswith("#"):
+            yield formula
+
+
+def compute(
+    formulas: List[str],
+    options: Dict[str, Any],
+    cache: Optional[str] = None,
+    cache_size: Optional[int] = resultcache.MAX_BYTES,
+) -> List[Dict[str, Any]]:
+    """
+    Compute the isotope pattern of a chunk of formulas. Errors are reported in the record
+    of the corresponding formula so that a single bad formula does not abort the batch.
+
+    Arguments
+    ---------
+    formulas: List[str]
+        The list of brute formulas to process.
+    options: Dict[str, Any]
+        The keyword arguments passed to `isomol.process`.
+    cache: Optional[str]
+        If given, the path of the persistent cache (see `resultcache.ResultCache`) from
+        which the patterns already computed are taken and in which the new ones are stored.
+    cache_size: Optional[int]
+        The maximum size in bytes of the persistent cache.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The list of records containing the formula and either the `peaks` or the `error`.
+    """
+    if cache is not None:
+        cache = resultcache.open_cache(cache, cache_size)
+
+    records = []
+    for formula in formulas:
+        try:
+            composition = isomol.parse_formula(formula)
+            if cache is None:
+                peaks = isomol.process(composition, **options)
+            else:
+                peaks = resultcache.process(composition, cache, **options)
+        except Exception as error:
+            records.append(
+                {"formula": formula, "error": f"{type(error).__name__}: {error}"}
+            )
+        else:
+            records.append({"formula": formula, "peaks": peaks})
+
+    return records
+
+
+def chunks(formulas: Iterable[str], size: int) -> Iterator[List[str]]:
+    """
+    Group an iterable of formulas in lists of a given size.
+    """
+    chunk = []
+    for formula in formulas:
+        chunk.append(formula)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def write_record(stream: TextIO, record: Dict[str, Any], fmt: str) -> None:
+    """
+    Write a record to the output stream in JSON lines (`jsonl`) or CSV (`csv`) format and
+    flush it so that the output is always complete up to the last written record. For the
+    binary formats (`npz` and `npy`) the stream is an `export.LibraryWriter` to which the
+    computed patterns are added, while the records reporting an error are skipped.
+    """
+    if fmt in BINARY_FORMATS:
+        if "peaks" in record:
+            stream.add(record["formula"], record["peaks"])
+        return
+
+    if fmt == "jsonl":
+        stream.write(json.dumps(record) + "\n")
+
+    else:
+        peaks = record.get("peaks", [])
+        csv.writer(stream).writerow(
+            [
+                record["formula"],
+                record.get("error", ""),
+                " ".join(f"{mass:.10f}" for mass, _ in peaks),
+                " ".join(f"{intensity:.10e}" for _, intensity in peaks),
+            ]
+        )
+
+    stream.flush()
+
+
+def completed_formulas(path: str, fmt: str) -> Set[str]:
+    """
+    Read a partially written output file returning the set of formulas already processed
+    successfully, so that the ones whose record reports an error are computed again. A
+    trailing incomplete record, left by an interrupted run, is removed from the file.
+
+    Arguments
+    ---------
+    path: str
+        The path of the output file.
+    fmt: str
+        The format of the output file (`jsonl` or `csv`).
+
+    Returns
+    -------
+    Set[str]
+        The set of formulas with a complete record containing their peaks in the file.
+    """
+    if not os.path.isfile(path):
+        return set()
+
+    with open(path, "rb+") as stream:
+        data = stream.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            stream.truncate(end)
+
+    done = set()
+    with open(path, "r", newline="") as stream:
+        if fmt == "jsonl":
+            for line in stream:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "peaks" in record and "formula" in record:
+                    done.add(record["formula"])
+        else:
+            for row in csv.reader(stream):
+                if row and row != CSV_FIELDS and len(row) > 1 and row[1] == "":
+                    done.add(row[0])
+
+    return done
+
+
+def run(
+    formulas: Iterable[str],
+    output: TextIO,
+    fmt: str = "jsonl",
+    workers: Optional[int] = None,
+    chunksize: int = 16,
+    skip: Optional[Set[str]] = None,
+    cache: Optional[str] = None,
+    cache_size: Optional[int] = resultcache.MAX_BYTES,
+    **options,
+) -> int:
+    """
+    Compute the isotope patterns of a stream of formulas in a pool of worker processes,
+    writing each record to the output as soon as its chunk is completed. The number of
+    chunks in flight is bounded so that arbitrarily long inputs can be streamed.
+
+    Arguments
+    ---------
+    formulas: Iterable[str]
+        The iterable over the formulas to process.
+    output: TextIO
+        The stream on which the records are written.
+    fmt: str
+        The output format: `jsonl` (default) or `csv`.
+    workers: Optional[int]
+        The number of worker processes (default: the number of CPUs).
+    chunksize: int
+        The number of formulas submitted to a worker at once.
+    skip: Optional[Set[str]]
+        The set of formulas to skip, e.g. the ones already processed in a previous run.
+    cache: Optional[str]
+        If given, the path of the persistent cache shared by the worker processes.
+    cache_size: Optional[int]
+        The maximum size in bytes of the persistent cache.
+    **options
+        The keyword arguments passed to `isomol.process`.
+
+    Returns
+    -------
+    int
+        The number of formulas for which an error has been reported.
+    """
+    skip = set() if skip is None else skip
+    pending = (formula for formula in formulas if formula not in skip)
+
+    workers = workers or os.cpu_count() or 1
+    limit = 2 * workers
+
+    errors = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = set()
+
+        for chunk in chunks(pending, chunksize):
+            running.add(executor.submit(compute, chunk, options, cache, cache_size))
+            if len(running) < limit:
+                continue
+
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            errors += _write(done, output, fmt)
+
+        done, _ = wait(running)
+        errors += _write(done, output, fmt)
+
+    return errors
+
+
+def _write(futures, output: TextIO, fmt: str) -> int:
+    errors = 0
+    for future in futures:
+        for record in future.result():
+            errors += "error" in record
+            write_record(output, record, fmt)
+
+    return errors
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(
+        description="Compute the isotope patterns of a list of brute formulas."
+    )
+    parser.add_argument(
+        "input",
+        nargs="?",
+        default="-",
+        help="file containing one formula per line (default: read from stdin)",
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="output file (default: write to stdout)"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=["jsonl", "csv"] + BINARY_FORMATS,
+        help="output format (default: guessed from the output extension or jsonl); npz "
+        "writes a single archive while npy writes a directory of memory-mappable arrays",
+    )
+    parser.add_argument("-w", "--workers", type=int, help="number of worker processes")
+    parser.add_argument(
+        "-c",
+        "--chunksize",
+        type=int,
+        default=16,
+        help="formulas per task (default: 16)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the formulas already present in the output file and append to it",
+    )
+    parser.add_argument(
+        "--normalize", action="store_true", help="set the largest peak to 100"
+    )
+    parser.add_argument("--equivalent", type=float, default=1e-8)
+    parser.add_argument("--dump", type=float, default=1e-12)
+    parser.add_argument(
+        "--backend", choices=["python", "numpy", "auto"], default="python"
+    )
+    parser.add_argument(
+        "--coverage", type=float, default=1.0, help="minimum probability coverage"
+    )
+    parser.add_argument(
+        "--max-peaks", type=int, help="maximum number of peaks kept at each step"
+    )
+    parser.add_argument(
+        "--cache", help="persistent cache file shared across runs and worker processes"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=resultcache.MAX_BYTES / 1024**2,
+        help="maximum size of the persistent cache in MB (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None:
+        extension = os.path.splitext(args.output.lower())[1].lstrip(".")
+        fmt = extension if extension in ["csv"] + BINARY_FORMATS else "jsonl"
+
+    if fmt in BINARY_FORMATS and (args.output == "-" or args.resume):
+        parser.error("the binary formats require an output file and cannot be resumed")
+
+    options = {
+        "normalize": args.normalize,
+        "equivalent": args.equivalent,
+        "dump": args.dump,
+        "backend": args.backend,
+        "coverage": args.coverage,
+        "max_peaks": args.max_peaks,
+    }
+
+    skip = set()
+    if args.output == "-":
+        output = sys.stdout
+    elif fmt in BINARY_FORMATS:
+        import export
+
+        output = export.LibraryWriter(args.output)
+    else:
+        if args.resume:
+            skip = completed_formulas(args.output, fmt)
+
+        header = fmt == "csv" and not (args.resume and os.path.isfile(args.output))
+        output = open(args.output, "a" if args.resume else "w", newline="")
+        if header:
+            csv.writer(output).writerow(CSV_FIELDS)
+
+    source = sys.stdin if args.input == "-" else open(args.input, "r")
+
+    try:
+        errors = run(
+            read_formulas(source),
+            output,
+            fmt,
+            args.workers,
+            args.chunksize,
+            skip,
+            args.cache,
+            int(args.cache_size * 1024**2),
+            **options,
+        )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    if errors != 0:
+        print(f"{errors} formulas could not be processed", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,353 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Any, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must not be loaded by a plain `import isomol`
+HEAVY_MODULES = ["matplotlib", "numpy", "PyQt5"]
+
+# Default file storing the reference results of the corpus
+REFERENCE = os.path.join(HERE, "benchmark_reference.json")
+
+# Representative formulas grouped by category
+CORPUS = {
+    "organics": ["CH4", "C6H6", "C6H12O6", "C8H10N4O2", "C9H8O4", "C20H25N3O"],
+    "readme": ["CCl4"],
+    "metals": ["SnCl4", "C24H20Sn", "HgCl2", "Hg2Br2", "XeF6", "Sn2Hg2Xe2"],
+    "large": [
+        "C257H383N65O77S6",
+        "C378H630N105O118S",
+        "C390H595N109O115S3",
+        "[C8H8]100",
+        "H[C2H4O]200OH",
+        "C2000H4002",
+    ],
+}
+
+# Tolerances used to compare the results with the reference ones
+MASS_TOLERANCE = 1e-7
+INTENSITY_TOLERANCE = 1e-6
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import isomol
+elapsed = time.perf_counter() - start
+print(json.dumps({"time": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def import_time(repeat: int = 5) -> Dict[str, object]:
+    """
+    Measure the time required to import the `isomol` module in a fresh interpreter and
+    check which of the heavy optional dependencies are loaded by the import.
+
+    Arguments
+    ---------
+    repeat: int
+        The number of fresh interpreters started. The best time is reported.
+
+    Returns
+    -------
+    Dict[str, object]
+        The dictionary with the best import `time` in seconds and the list of the heavy
+        modules `loaded` by the import.
+    """
+    times, loaded = [], set()
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT % HEAVY_MODULES],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output)
+        times.append(result["time"])
+        loaded.update(result["loaded"])
+
+    return {"time": min(times), "loaded": sorted(loaded)}
+
+
+def measure(formula: str, repeat: int = 3, top: int = 10, **options) -> Dict[str, Any]:
+    """
+    Run a formula through the parser and the engine, measuring the best wall time over a
+    number of repetitions and the peak memory allocated by a separate run, and summarize
+    the obtained pattern.
+
+    Arguments
+    ---------
+    formula: str
+        The brute formula to process.
+    repeat: int
+        The number of timed repetitions. The best time is reported.
+    top: int
+        The number of most intense peaks stored in the summary.
+    **options
+        The keyword arguments passed to `isomol.process`. Unless otherwise specified the
+        element cache is disabled so that every repetition is computed from scratch.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The dictionary with the `time` in seconds, the peak `memory` in bytes, the number of
+        `peaks`, the `total` probability (in percent), the `monoisotopic` mass and the `top`
+        most intense peaks.
+    """
+    import isomol
+
+    options.setdefault("cache", False)
+
+    times = []
+    for _ in range(repeat):
+        isomol._parse.cache_clear()
+        start = time.perf_counter()
+        peaks = isomol.process(isomol.parse_formula(formula), **options)
+        times.append(time.perf_counter() - start)
+
+    isomol._parse.cache_clear()
+    tracemalloc.start()
+    try:
+        isomol.process(isomol.parse_formula(formula), **options)
+        _, memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # The monoisotopic peak is the one closest to the mass of the most abundant isotopes
+    table = isomol.get_table(options.get("table"))
+    mass = sum(n * table[e].masses[0] for e, n in isomol.parse_formula(formula))
+    monoisotopic = min(peaks, key=lambda peak: abs(peak[0] - mass))[0]
+
+    return {
+        "time": min(times),
+        "memory": memory,
+        "peaks": len(peaks),
+        "total": sum(intensity for _, intensity in peaks),
+        "monoisotopic": monoisotopic,
+        "top": sorted(peaks, key=lambda peak: -peak[1])[:top],
+    }
+
+
+def run_corpus(
+    categories: Optional[List[str]] = None, repeat: int = 3, top: int = 10, **options
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Measure all the formulas of the selected categories of the corpus (default: all).
+    """
+    categories = list(CORPUS) if categories is None else categories
+
+    results = {}
+    for category in categories:
+        for formula in CORPUS[category]:
+            results[formula] = measure(formula, repeat, top, **options)
+            results[formula]["category"] = category
+
+    return results
+
+
+def check(
+    results: Dict[str, Dict[str, Any]], reference: Dict[str, Dict[str, Any]]
+) -> List[str]:
+    """
+    Compare the patterns summarized in two sets of results, returning the description of
+    each difference above the tolerances (the number of peaks must match exactly).
+    Formulas missing from either set are ignored.
+
+    Arguments
+    ---------
+    results: Dict[str, Dict[str, Any]]
+        The results to check.
+    reference: Dict[str, Dict[str, Any]]
+        The reference results.
+
+    Returns
+    -------
+    List[str]
+        The list of the differences found (empty if the results agree).
+    """
+    errors = []
+    for formula in results.keys() & reference.keys():
+        new, old = results[formula], reference[formula]
+
+        if abs(new["total"] - old["total"]) > 100 * INTENSITY_TOLERANCE:
+            errors.append(
+                f"{formula}: total {new['total']:.10f} != {old['total']:.10f}"
+            )
+
+        if (
+            abs(new["monoisotopic"] - old["monoisotopic"])
+            > MASS_TOLERANCE * old["monoisotopic"]
+        ):
+            errors.append(
+                f"{formula}: monoisotopic mass {new['monoisotopic']:.10f} != "
+                f"{old['monoisotopic']:.10f}"
+            )
+
+        if new["peaks"] != old["peaks"]:
+            errors.append(f"{formula}: {new['peaks']} peaks != {old['peaks']}")
+
+        if len(new["top"]) != len(old["top"]):
+            errors.append(
+                f"{formula}: {len(new['top'])} top peaks != {len(old['top'])}"
+            )
+            continue
+
+        for (m1, i1), (m2, i2) in zip(new["top"], old["top"]):
+            if abs(m1 - m2) > MASS_TOLERANCE * m2 or abs(
+                i1 - i2
+            ) > INTENSITY_TOLERANCE * max(i2, 1e-300):
+                errors.append(
+                    f"{formula}: peak {m1:.10f} ({i1:.6e}) != {m2:.10f} ({i2:.6e})"
+                )
+                break
+
+    return sorted(errors)
+
+
+def print_results(
+    results: Dict[str, Dict[str, Any]],
+    baseline: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> None:
+    """
+    Print the measured times, memory and peak counts, together with the ratio with
+    respect to a baseline run if given.
+    """
+    print(
+        f"{'Formula':>22} | {'Category':>8} | {'Time (ms)':>10} | {'Memory (kB)':>11} | "
+        f"{'Peaks':>6}" + (" | Time ratio | Memory ratio" if baseline else "")
+    )
+    print("-" * (72 + (28 if baseline else 0)))
+    for formula, result in results.items():
+        line = (
+            f"{formula:>22} | {result['category']:>8} | {1000 * result['time']:>10.3f} | "
+            f"{result['memory'] / 1024:>11.1f} | {result['peaks']:>6}"
+        )
+        if baseline and formula in baseline:
+            old = baseline[formula]
+            line += (
+                f" | {result['time'] / max(old['time'], 1e-12):>10.2f}"
+                f" | {result['memory'] / max(old['memory'], 1):>12.2f}"
+            )
+        print(line)
+
+
+def load(path: str) -> Dict[str, Dict[str, Any]]:
+    with open(path, "r") as stream:
+        return json.load(stream)
+
+
+def save(results: Dict[str, Dict[str, Any]], path: str) -> None:
+    with open(path, "w") as stream:
+        json.dump(results, stream, indent=1)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(description="Benchmarks of the IsoMol engine.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_import = subparsers.add_parser(
+        "import", help="measure the import time of the isomol module"
+    )
+    parser_import.add_argument("--repeat", type=int, default=5)
+    parser_import.add_argument(
+        "--budget",
+        type=float,
+        default=0.05,
+        help="maximum allowed import time in seconds (default: 0.05)",
+    )
+
+    parser_corpus = subparsers.add_parser(
+        "corpus",
+        help="measure the formulas of the corpus and check them against the reference",
+    )
+    parser_corpus.add_argument(
+        "--category", nargs="+", choices=list(CORPUS), help="categories to run"
+    )
+    parser_corpus.add_argument("--repeat", type=int, default=3)
+    parser_corpus.add_argument(
+        "--top", type=int, default=10, help="number of peaks compared (default: 10)"
+    )
+    parser_corpus.add_argument(
+        "--backend", choices=["python", "numpy", "auto"], default="python"
+    )
+    parser_corpus.add_argument("-o", "--output", help="save the results to a file")
+    parser_corpus.add_argument(
+        "--reference",
+        default=REFERENCE,
+        help="file with the reference results (default: %(default)s)",
+    )
+    parser_corpus.add_argument(
+        "--update-reference",
+        action="store_true",
+        help="store the results as the new reference",
+    )
+
+    parser_compare = subparsers.add_parser(
+        "compare", help="compare two saved runs of the corpus"
+    )
+    parser_compare.add_argument("old", help="results of the baseline run")
+    parser_compare.add_argument("new", help="results of the new run")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "corpus":
+        results = run_corpus(args.category, args.repeat, args.top, backend=args.backend)
+
+        reference = None
+        if not args.update_reference and os.path.isfile(args.reference):
+            reference = load(args.reference)
+
+        print_results(results, reference)
+
+        if args.output is not None:
+            save(results, args.output)
+
+        if args.update_reference:
+            save(results, args.reference)
+            return 0
+
+        if reference is None:
+            print(f"No reference results found in {args.reference}")
+            return 0
+
+        errors = check(results, reference)
+        for error in errors:
+            print(f"FAIL: {error}")
+
+        return 1 if errors else 0
+
+    if args.command == "compare":
+        old, new = load(args.old), load(args.new)
+        print_results(new, old)
+
+        errors = check(new, old)
+        for error in errors:
+            print(f"DIFF: {error}")
+
+        return 1 if errors else 0
+
+    if args.command == "import":
+        result = import_time(args.repeat)
+        print(f"import isomol: {1000 * result['time']:.2f} ms")
+
+        failed = False
+        if result["loaded"]:
+            print(
+                f"FAIL: heavy modules loaded at import: {', '.join(result['loaded'])}"
+            )
+            failed = True
+        if result["time"] > args.budget:
+            print(f"FAIL: import time above the budget of {1000 * args.budget:.0f} ms")
+            failed = True
+
+        return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+import os
+import sys
+from argparse import ArgumentParser
+from array import array
+from collections.abc import Mapping
+from typing import Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple, Union
+
+import numpy as np
+
+# The arrays composing a library of patterns
+FIELDS = ("formulas", "offsets", "masses", "intensities")
+
+
+class Library(Mapping):
+    """
+    Read-only collection of isotope patterns stored in columnar form: the masses and
+    intensities of all the patterns are concatenated in two arrays and the peaks of the
+    i-th formula are the ones between `offsets[i]` and `offsets[i + 1]`. The patterns are
+    returned as views of the columns, so that a memory-mapped library is never copied.
+
+    Arguments
+    ---------
+    formulas: np.ndarray
+        The formulas of the patterns.
+    offsets: np.ndarray
+        The offset of the first peak of each pattern followed by the total number of peaks.
+    masses: np.ndarray
+        The concatenated masses of the peaks.
+    intensities: np.ndarray
+        The concatenated intensities of the peaks.
+    """
+
+    def __init__(
+        self,
+        formulas: np.ndarray,
+        offsets: np.ndarray,
+        masses: np.ndarray,
+        intensities: np.ndarray,
+    ) -> None:
+        if offsets.size != formulas.size + 1 or masses.size != intensities.size:
+            raise ValueError("Inconsistent library arrays")
+
+        self.formulas = formulas
+        self.offsets = offsets
+        self.masses = masses
+        self.intensities = intensities
+        self.__index = None
+
+    def __len__(self) -> int:
+        return self.formulas.size
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.formulas.tolist())
+
+    def __getitem__(self, formula: str) -> Tuple[np.ndarray, np.ndarray]:
+        if self.__index is None:
+            self.__index = {f: i for i, f in enumerate(self.formulas.tolist())}
+
+        return self.pattern(self.__index[formula])
+
+    def pattern(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the masses and intensities of the index-th pattern as views of the columns.
+        """
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        return self.masses[start:stop], self.intensities[start:stop]
+
+
+class LibraryWriter:
+    """
+    Accumulate isotope patterns in compact arrays and save them as a library when closed.
+    The library is saved as a single `.npz` archive if the path ends with `.npz` or
+    otherwise as a directory of `.npy` files that can be memory-mapped.
+
+    Arguments
+    ---------
+    path: str
+        The path of the `.npz` archive or of the directory.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.__formulas = []
+        self.__offsets = array("q", [0])
+        self.__masses = array("d")
+        self.__intensities = array("d")
+
+    def __enter__(self) -> "LibraryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # Nothing is written if the patterns were not all added
+        if exc_type is None:
+            self.close()
+
+    def add(
+        self, formula: str, peaks: Union[List[List[float]], Sequence[Sequence[float]]]
+    ) -> None:
+        """
+        Append the pattern of a formula to the library.
+        """
+        for mass, intensity in peaks:
+            self.__masses.append(mass)
+            self.__intensities.append(intensity)
+
+        self.__formulas.append(formula)
+        self.__offsets.append(len(self.__masses))
+
+    def close(self) -> None:
+        """
+        Write the library to disk.
+        """
+        save_arrays(
+            self.path,
+            np.array(self.__formulas, dtype=str),
+            np.frombuffer(self.__offsets, dtype=np.int64),
+            np.frombuffer(self.__masses),
+            np.frombuffer(self.__intensities),
+        )
+
+
+def save_arrays(
+    path: str,
+    formulas: np.ndarray,
+    offsets: np.ndarray,
+    masses: np.ndarray,
+    intensities: np.ndarray,
+) -> None:
+    """
+    Save the arrays of a library as a `.npz` archive or as a directory of `.npy` files.
+    """
+    arrays = dict(zip(FIELDS, (formulas, offsets, masses, intensities)))
+
+    if path.endswith(".npz"):
+        np.savez(path, **arrays)
+    else:
+        os.makedirs(path, exist_ok=True)
+        for name, values in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), values)
+
+
+def save_library(path: str, patterns: Iterable[Tuple[str, List[List[float]]]]) -> None:
+    """
+    Save a collection of isotope patterns as a library.
+
+    Arguments
+    ---------
+    path: str
+        The path of the `.npz` archive or of the directory of memory-mappable `.npy` files.
+    patterns: Iterable[Tuple[str, List[List[float]]]]
+        The couples of formula and list of lists encoding the mass and intensity of each
+        peak.
+    """
+    with LibraryWriter(path) as writer:
+        for formula, peaks in patterns:
+            writer.add(formula, peaks)
+
+
+def load_library(path: str, mmap: bool = True) -> Library:
+    """
+    Load a library of isotope patterns.
+
+    Arguments
+    ---------
+    path: str
+        The path of the `.npz` archive or of the directory of `.npy` files.
+    mmap: bool
+        If set to True (default) the `.npy` files are memory-mapped instead of being read.
+        The arrays of a `.npz` archive are always read in memory.
+
+    Returns
+    -------
+    Library
+        The library of patterns.
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return Library(*(data[name] for name in FIELDS))
+
+    return Library(
+        *(
+            np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in FIELDS
+        )
+    )
+
+
+def write_csv(
+    stream: TextIO,
+    masses: Sequence[float],
+    intensities: Sequence[float],
+    chunksize: int = 65536,
+) -> None:
+    """
+    Write the peaks of a pattern as CSV lines (mass, intensity), formatting them in chunks
+    so that large patterns are written with few calls to the stream.
+    """
+    fmt = "{:.10f}, {:.10f}\n"
+    for start in range(0, len(masses), chunksize):
+        stop = start + chunksize
+        stream.write(
+            "".join(
+                fmt.format(mass, intensity)
+                for mass, intensity in zip(masses[start:stop], intensities[start:stop])
+            )
+        )
+
+
+def save(
+    path: str, formula: str, masses: Sequence[float], intensities: Sequence[float]
+) -> None:
+    """
+    Save a single pattern choosing the format from the path: CSV for `.csv` files, a
+    library containing a single pattern for `.npz` archives and a directory of `.npy`
+    files otherwise.
+    """
+    if path.endswith(".csv"):
+        with open(path, "w", buffering=1024**2) as stream:
+            write_csv(stream, masses, intensities)
+    else:
+        with LibraryWriter(path) as writer:
+            writer.add(formula, zip(masses, intensities))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(description="Inspect or convert a library of patterns.")
+    parser.add_argument("library", help="path of the .npz archive or .npy directory")
+    parser.add_argument("formulas", nargs="*", help="formulas whose pattern is printed")
+    parser.add_argument("--csv", help="convert the whole library to a CSV file")
+    args = parser.parse_args(argv)
+
+    library = load_library(args.library)
+    print(f"{len(library)} patterns, {library.masses.size} peaks")
+
+    for formula in args.formulas:
+        if formula not in library:
+            print(f"\n{formula}: not found in the library")
+            continue
+
+        masses, intensities = library[formula]
+        print(f"\n{formula}")
+        for mass, intensity in zip(masses.tolist(), intensities.tolist()):
+            print(f"{mass:>12.6f} | {intensity:.4e}")
+
+    if args.csv is not None:
+        with open(args.csv, "w", buffering=1024**2) as stream:
+            stream.write("formula,mass,intensity\n")
+            for i, formula in enumerate(library):
+                masses, intensities = library.pattern(i)
+                stream.write(
+                    "".join(
+                        f"{formula},{mass:.10f},{intensity:.10e}\n"
+                        for mass, intensity in zip(
+                            masses.tolist(), intensities.tolist()
+                        )
+                    )
+                )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
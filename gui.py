@@ -1,4 +1,6 @@
+import export
 import isomol
+import numpy as np
 
 from os.path import join
 
@@ -6,10 +8,16 @@ from base import Ui_MainWindow
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 from matplotlib.backends.backend_qt5agg import FigureCanvas, NavigationToolbar2QT
+from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
 
 
 class MplWidget(QtWidgets.QWidget):
+    """
+    Stick spectrum plot drawn with a single `LineCollection` updated in place. Only the
+    most intense stick of each pixel column in the visible mass range is drawn, and the
+    selection is updated when the plot is zoomed, panned or resized.
+    """
     
     def __init__(self, parent=None, dpi=100):
 
@@ -30,23 +38,210 @@ class MplWidget(QtWidgets.QWidget):
         self.canvas.axes.set_xlabel("Mass [amu]")
         self.canvas.axes.set_ylabel("Intensity [a.u.]")
 
+        self.canvas.axes.grid(which="major", c="#DDDDDD")
+        self.canvas.axes.grid(which="minor", c="#EEEEEE")
+
+        self.__masses = np.zeros(0)
+        self.__intensities = np.zeros(0)
+        self.__ylogscale = False
+        self.__decimate = True
+
+        self.lines = LineCollection([], linewidths=1.5, colors="C0")
+        self.canvas.axes.add_collection(self.lines)
+
+        self.canvas.axes.callbacks.connect("xlim_changed", lambda axes: self.update_lines())
+        self.canvas.mpl_connect("resize_event", lambda event: self.update_lines())
+
         self.setLayout(vertical_layout)
     
     def plot_data(self, masses, intensities, ylogscale = False):
-        self.canvas.axes.clear()
-        self.canvas.axes.stem(masses, intensities, basefmt="none", markerfmt="none")
+        order = np.argsort(masses)
+        self.__masses = np.asarray(masses, dtype=float)[order]
+        self.__intensities = np.asarray(intensities, dtype=float)[order]
+
+        if self.__masses.size != 0:
+            margin = max(1.0, 0.05 * (self.__masses[-1] - self.__masses[0]))
+            self.canvas.axes.set_xlim([self.__masses[0] - margin, self.__masses[-1] + margin])
+
+        self.set_ylogscale(ylogscale)
+
+    def clear(self):
+        self.plot_data([], [], self.__ylogscale)
+
+    def set_ylogscale(self, ylogscale):
+        self.__ylogscale = ylogscale
 
         if ylogscale:
+            positive = self.__intensities[self.__intensities > 0]
+            bottom = positive.min() / 2 if positive.size != 0 else 1e-3
             self.canvas.axes.set_yscale("log")
+            self.canvas.axes.set_ylim([bottom, 200])
         else:
             self.canvas.axes.set_yscale("linear")
             self.canvas.axes.set_ylim([0, 105])
-        
-        self.canvas.axes.grid(which="major", c="#DDDDDD")
-        self.canvas.axes.grid(which="minor", c="#EEEEEE")
 
-        self.canvas.axes.set_xlabel("Mass [amu]")
-        self.canvas.axes.set_ylabel("Intensity [a.u.]")
+        self.update_lines()
+
+    def update_lines(self):
+        masses, intensities = self.__masses, self.__intensities
+
+        if self.__decimate and masses.size != 0:
+            # Select the sticks in the visible range and keep the most intense of each pixel column
+            x0, x1 = self.canvas.axes.get_xlim()
+            start, stop = np.searchsorted(masses, [x0, x1])
+            masses, intensities = masses[start:stop], intensities[start:stop]
+
+            width = max(int(self.canvas.axes.bbox.width), 1)
+            columns = ((masses - x0) * (width / (x1 - x0))).astype(int)
+            order = np.lexsort((intensities, columns))
+            last = np.diff(columns[order], append=-1) != 0
+            keep = order[last]
+            masses, intensities = masses[keep], intensities[keep]
+
+        bottom = self.canvas.axes.get_ylim()[0] if self.__ylogscale else 0
+        segments = np.empty((masses.size, 2, 2))
+        segments[:, :, 0] = masses[:, None]
+        segments[:, 0, 1] = bottom
+        segments[:, 1, 1] = intensities
+        self.lines.set_segments(segments)
+
+        self.canvas.draw_idle()
+
+    def savefig(self, filename, dpi=600):
+        # Draw all the sticks since the decimation depends on the resolution of the screen
+        self.__decimate = False
+        self.update_lines()
+        try:
+            self.fig.savefig(filename, dpi=dpi)
+        finally:
+            self.__decimate = True
+            self.update_lines()
+
+
+class PeakTableModel(QtCore.QAbstractTableModel):
+    """
+    Table model exposing the masses and intensities of the peaks stored as arrays. The
+    cells are formatted only when displayed, while sorting and filtering by an intensity
+    threshold only reorder an array of row indices.
+    """
+
+    HEADERS = ["Mass (amu)", "Intensity (%)"]
+    FORMATS = ["{:.6f}", "{:.3e}"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.__columns = [np.zeros(0), np.zeros(0)]
+        self.__rows = np.zeros(0, dtype=int)
+        self.__threshold = 0.0
+        self.__sort_column = 0
+        self.__sort_order = QtCore.Qt.AscendingOrder
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.__rows.size
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else 2
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if role == QtCore.Qt.DisplayRole:
+            value = self.__columns[index.column()][self.__rows[index.row()]]
+            return self.FORMATS[index.column()].format(value)
+
+        if role == QtCore.Qt.TextAlignmentRole:
+            return int(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+
+        return super().headerData(section, orientation, role)
+
+    def set_peaks(self, masses, intensities):
+        self.beginResetModel()
+        self.__columns = [
+            np.asarray(masses, dtype=float),
+            np.asarray(intensities, dtype=float),
+        ]
+        self.__update_rows()
+        self.endResetModel()
+
+    def set_threshold(self, threshold):
+        self.beginResetModel()
+        self.__threshold = threshold
+        self.__update_rows()
+        self.endResetModel()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self.__sort_column = column
+        self.__sort_order = order
+        self.__update_rows()
+        self.layoutChanged.emit()
+
+    def __update_rows(self):
+        values = self.__columns[self.__sort_column]
+        rows = np.flatnonzero(self.__columns[1] >= self.__threshold)
+        rows = rows[np.argsort(values[rows], kind="stable")]
+        if self.__sort_order == QtCore.Qt.DescendingOrder:
+            rows = rows[::-1]
+        self.__rows = rows
+
+
+class Cancelled(Exception):
+    pass
+
+
+class WorkerSignals(QtCore.QObject):
+
+    progress = QtCore.pyqtSignal(int, int, int)
+    finished = QtCore.pyqtSignal(int, object)
+    failed = QtCore.pyqtSignal(int, str)
+
+
+class Worker(QtCore.QRunnable):
+    """
+    Compute the isotope pattern of a formula outside of the main thread. The results are
+    sent back through the signals together with the job number, so that the results of
+    stale jobs can be ignored, while `cancel` aborts the computation at the next step.
+    """
+
+    def __init__(self, job, formula):
+        super().__init__()
+        self.job = job
+        self.formula = formula
+        self.signals = WorkerSignals()
+        self.__cancelled = False
+
+    def cancel(self):
+        self.__cancelled = True
+
+    def progress(self, done, total):
+        if self.__cancelled:
+            raise Cancelled()
+        self.signals.progress.emit(self.job, done, total)
+
+    def run(self):
+        try:
+            if self.__cancelled:
+                raise Cancelled()
+
+            composition = isomol.parse_formula(self.formula)
+            peaks = isomol.process(composition, normalize=True, progress=self.progress)
+            peaks.sort(key=lambda peak: peak[0])
+
+        except Cancelled:
+            return
+
+        except Exception as error:
+            self.signals.failed.emit(self.job, str(error))
+
+        else:
+            self.signals.finished.emit(self.job, peaks)
 
 
 class Ui_IsoMol(Ui_MainWindow):
@@ -58,13 +253,37 @@ class Ui_IsoMol(Ui_MainWindow):
         self.__intensities = []
         self.__ylogscale = False
 
+        # A single worker thread: a new job starts as soon as the cancelled one returns
+        self.__pool = QtCore.QThreadPool()
+        self.__pool.setMaxThreadCount(1)
+        self.__job = 0
+        self.__worker = None
+        self.__interactive = False
+
+        self.__timer = QtCore.QTimer()
+        self.__timer.setSingleShot(True)
+        self.__timer.setInterval(400)
+        self.__timer.timeout.connect(self.preview)
+
+        self.progressBar = QtWidgets.QProgressBar()
+        self.progressBar.setMaximumWidth(200)
+        self.progressBar.setVisible(False)
+        self.statusbar.addPermanentWidget(self.progressBar)
+
+        self.previewCheckBox = QtWidgets.QCheckBox("Live preview")
+        self.statusbar.addPermanentWidget(self.previewCheckBox)
+
         MainWindow.setFixedSize(MainWindow.size())
 
         geometry = self.mplWidget.geometry()
         self.mplWidget = MplWidget(self.centralwidget)
         self.mplWidget.setGeometry(geometry)
 
-        self.tableWidget.setColumnCount(2)
+        self.tableModel = PeakTableModel()
+        self.tableView.setModel(self.tableModel)
+        self.tableView.setSortingEnabled(True)
+        self.tableView.sortByColumn(0, QtCore.Qt.AscendingOrder)
+        self.thresholdSpinBox.valueChanged.connect(self.tableModel.set_threshold)
         self.reset_table()
 
         self.formulaEdit.textChanged.connect(self.formula_changed)
@@ -85,15 +304,13 @@ class Ui_IsoMol(Ui_MainWindow):
         super().retranslateUi(MainWindow)
 
     def reset_table(self):
-        self.tableWidget.clear()
-        self.tableWidget.setHorizontalHeaderLabels(["Mass (amu)", "Intensity (%)"])
-        self.tableWidget.setRowCount(0)
+        self.tableModel.set_peaks([], [])
 
     def formula_changed(self):
 
+        self.cancel()
         self.reset_table()
-        self.mplWidget.canvas.axes.clear()
-        self.mplWidget.canvas.draw()
+        self.mplWidget.clear()
         self.saveButton.setEnabled(False)
         self.exportButton.setEnabled(False)
         self.YLogscaleCheckBox.setEnabled(False)
@@ -105,56 +322,107 @@ class Ui_IsoMol(Ui_MainWindow):
             self.computeButton.setEnabled(False)
         else:
             self.computeButton.setEnabled(True)
-
+            if self.previewCheckBox.isChecked():
+                self.__timer.start()
 
     def compute(self):
-        self.__formula = self.formulaEdit.text()
+        if self.__worker is not None:
+            self.cancel()
+        else:
+            self.start(self.formulaEdit.text(), interactive=True)
 
-        try:
-            composition = isomol.parse_formula(self.__formula)
-            peaks = isomol.process(composition, normalize=True)
-            peaks.sort(key=lambda peak: peak[0])
-        
-        except:
+    def preview(self):
+        if self.formulaEdit.text() != "":
+            self.start(self.formulaEdit.text(), interactive=False)
+
+    def start(self, formula, interactive):
+        self.cancel()
+
+        self.__job += 1
+        self.__interactive = interactive
+        self.__worker = Worker(self.__job, formula)
+        self.__worker.signals.progress.connect(self.job_progress)
+        self.__worker.signals.finished.connect(self.job_finished)
+        self.__worker.signals.failed.connect(self.job_failed)
+        self.__pool.start(self.__worker)
+
+        self.computeButton.setText("Cancel")
+        self.progressBar.setValue(0)
+        self.progressBar.setVisible(True)
+
+    def cancel(self):
+        self.__timer.stop()
+
+        if self.__worker is not None:
+            self.__worker.cancel()
+            self.__worker = None
+
+        self.computeButton.setText("Compute")
+        self.progressBar.setVisible(False)
+
+    def job_progress(self, job, done, total):
+        if job == self.__job:
+            self.progressBar.setMaximum(total)
+            self.progressBar.setValue(done)
+
+    def job_failed(self, job, message):
+        if job != self.__job or self.__worker is None:
+            return
+
+        self.cancel()
+        if self.__interactive:
             msg = QtWidgets.QMessageBox()
             msg.setIcon(QtWidgets.QMessageBox.Critical)
             msg.setText("Invalid formula")
             msg.setInformativeText('The formula given by the user is invalid')
+            msg.setDetailedText(message)
             msg.setWindowTitle("Input error")
             msg.exec_()
-        
-        else:
-            self.__masses = [peak[0] for peak in peaks]
-            self.__intensities = [peak[1] for peak in peaks]
 
-            self.tableWidget.setRowCount(len(peaks))
-            for i, (mass, intensity) in enumerate(zip(self.__masses, self.__intensities)):
-                self.tableWidget.setItem(i, 0, QtWidgets.QTableWidgetItem(f"{mass:.6f}"))
-                self.tableWidget.setItem(i, 1, QtWidgets.QTableWidgetItem(f"{intensity:.3e}"))
+    def job_finished(self, job, peaks):
+        if job != self.__job or self.__worker is None:
+            return
 
-            self.update_plot()
+        self.__formula = self.__worker.formula
+        self.cancel()
 
-            self.saveButton.setEnabled(True)
-            self.exportButton.setEnabled(True)
-            self.YLogscaleCheckBox.setEnabled(True)
+        self.__masses = [peak[0] for peak in peaks]
+        self.__intensities = [peak[1] for peak in peaks]
+
+        self.tableModel.set_peaks(self.__masses, self.__intensities)
+
+        self.update_plot()
+
+        self.saveButton.setEnabled(True)
+        self.exportButton.setEnabled(True)
+        self.YLogscaleCheckBox.setEnabled(True)
 
     def update_plot(self):
         self.mplWidget.plot_data(self.__masses, self.__intensities, self.__ylogscale)
-        self.mplWidget.canvas.draw()
 
     def save_plot(self):
         folder = QtWidgets.QFileDialog.getExistingDirectory(None, 'Select a folder:', '/home', QtWidgets.QFileDialog.ShowDirsOnly)
-        self.mplWidget.canvas.figure.savefig(join(folder, f"{self.__formula}.png"), dpi=600)
+        self.mplWidget.savefig(join(folder, f"{self.__formula}.png"), dpi=600)
     
     def save_csv(self):
-        folder = QtWidgets.QFileDialog.getExistingDirectory(None, 'Select a folder:', '/home', QtWidgets.QFileDialog.ShowDirsOnly)
-        with open(join(folder, f"{self.__formula}.csv"), "w") as csv:
-            for mass, intensity in zip(self.__masses, self.__intensities):
-                csv.write(f"{mass:.10f}, {intensity:.10f}\n")
+        filename, selected = QtWidgets.QFileDialog.getSaveFileName(
+            None,
+            'Export the peaks:',
+            join('/home', f"{self.__formula}.csv"),
+            "CSV file (*.csv);;NumPy archive (*.npz)",
+        )
+        if filename == "":
+            return
+
+        extension = ".npz" if "npz" in selected else ".csv"
+        if not filename.endswith(extension):
+            filename += extension
+
+        export.save(filename, self.__formula, self.__masses, self.__intensities)
     
     def set_ylogscale(self):
         self.__ylogscale = self.YLogscaleCheckBox.isChecked()
-        self.update_plot()
+        self.mplWidget.set_ylogscale(self.__ylogscale)
 
         
         
@@ -164,5 +432,6 @@ if __name__ == "__main__":
     MainWindow = QtWidgets.QMainWindow()
     ui = Ui_IsoMol()
     ui.setupUi(MainWindow)
+    app.aboutToQuit.connect(ui.cancel)
     MainWindow.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -1,6 +1,27 @@
+import heapq
+import re
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
 from copy import deepcopy
-from typing import List, Union
-import matplotlib.pyplot as plt
+from functools import lru_cache
+from hashlib import sha1
+from math import exp, lgamma, log
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 ISOTOPES = {
     "Ag": [[106.905095, 51.84], [108.904754, 48.16]],
@@ -303,44 +324,331 @@ ISOTOPES = {
 }
 
 
-def ischar(character: str) -> bool:
+# The mass of the electron in a.m.u.
+ELECTRON_MASS = 0.000548579909
+
+
+class Isotopes(NamedTuple):
+    """
+    The isotopes of an element stored as contiguous read-only arrays of doubles sorted by
+    decreasing abbundance. The probabilities are normalized to sum to one.
+    """
+
+    masses: memoryview
+    probabilities: memoryview
+    log_probabilities: memoryview
+
+
+def _readonly(values: Iterable[float]) -> memoryview:
+    return memoryview(array("d", values)).toreadonly()
+
+
+class IsotopeTable(Mapping):
+    """
+    Immutable table of the isotopes of each element. The masses and the probabilities of
+    the isotopes of each element are precomputed once in contiguous arrays, normalized and
+    sorted by decreasing abbundance, together with the log-probabilities. Custom tables
+    (e.g. for enriched 13C/15N labelled compounds or updated IUPAC data) can be created and
+    passed to the functions of the module without modifying the default one.
+
+    Arguments
+    ---------
+    data: Mapping[str, Sequence[Sequence[float]]]
+        The dictionary associating to each element symbol the list of [mass, abbundance]
+        couples of its isotopes, in the same form of `ISOTOPES`. The abbundances can be
+        given in any unit (e.g. percentage) since they are normalized for each element.
+    """
+
+    def __init__(self, data: Mapping[str, Sequence[Sequence[float]]]) -> None:
+        self.__data = {}
+        self.__elements = {}
+
+        for element, isotopes in data.items():
+            isotopes = sorted(
+                ((float(m), float(a)) for m, a in isotopes if a > 0),
+                key=lambda isotope: -isotope[1],
+            )
+            if isotopes == []:
+                raise ValueError(f"The element '{element}' has no isotope")
+
+            total = sum(isotope[1] for isotope in isotopes)
+            self.__data[element] = tuple((m, a / total) for m, a in isotopes)
+            self.__elements[element] = Isotopes(
+                _readonly(m for m, _ in isotopes),
+                _readonly(a / total for _, a in isotopes),
+                _readonly(log(a / total) for _, a in isotopes),
+            )
+
+        self.__fingerprint = sha1(
+            repr(sorted(self.__data.items())).encode()
+        ).hexdigest()
+
+    def __getitem__(self, element: str) -> Isotopes:
+        try:
+            return self.__elements[element]
+        except KeyError:
+            raise KeyError(f"Unknown element '{element}'") from None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__elements)
+
+    def __len__(self) -> int:
+        return len(self.__elements)
+
+    def __repr__(self) -> str:
+        return (
+            f"IsotopeTable({len(self)} elements, fingerprint={self.__fingerprint[:12]})"
+        )
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        The hash of the content of the table, stable across processes and sessions.
+        """
+        return self.__fingerprint
+
+    def pattern(self, element: str) -> List[List[float]]:
+        """
+        Return the isotopes of an element as list of [mass, probability] couples.
+        """
+        return [list(isotope) for isotope in self.__data[element]]
+
+    def updated(self, data: Mapping[str, Sequence[Sequence[float]]]) -> "IsotopeTable":
+        """
+        Return a new table in which the isotopes of the given elements are replaced, e.g.
+        `table.updated({"C": [[12.0, 1.0], [13.003355, 99.0]]})` for a 99% 13C label.
+
+        Arguments
+        ---------
+        data: Mapping[str, Sequence[Sequence[float]]]
+            The dictionary of the isotopes of the elements to add or replace.
+
+        Returns
+        -------
+        IsotopeTable
+            The new table.
+        """
+        new = dict(self.__data)
+        new.update(data)
+        return IsotopeTable(new)
+
+
+_DEFAULT_TABLE = None
+
+
+def get_table(table: Optional[IsotopeTable] = None) -> IsotopeTable:
+    """
+    Return the given isotope table or, if None, the default one built from `ISOTOPES`. The
+    default table is built only once, the first time it is required, so later changes to
+    `ISOTOPES` are not reflected by it: custom tables should be passed explicitly instead.
+
+    Arguments
+    ---------
+    table: Optional[IsotopeTable]
+        The custom table to use or None for the default one.
+
+    Returns
+    -------
+    IsotopeTable
+        The isotope table.
+    """
+    global _DEFAULT_TABLE
+
+    if table is not None:
+        return table
+
+    if _DEFAULT_TABLE is None:
+        _DEFAULT_TABLE = IsotopeTable(ISOTOPES)
+
+    return _DEFAULT_TABLE
+
+
+# Tokens of a brute formula: element symbols, numbers, opening and closing brackets,
+# separators of the hydration/addition units, whitespaces and invalid characters
+_TOKENS = re.compile(
+    r"(?P<element>[A-Z][a-z]?)|(?P<number>\d+)|(?P<open>[(\[{])|(?P<close>[)\]}])"
+    r"|(?P<separator>[·•.*])|(?P<space>\s+)|(?P<invalid>.)"
+)
+
+# Charge suffixes: ^2+ / ^+ / +2 / -2 / + / ++ / --- / [...]2-
+_CHARGE = re.compile(
+    r"(?:\^(?P<n1>\d*)(?P<s1>[+-])|\^?(?P<s2>[+-])(?P<n2>\d+)"
+    r"|(?<=\])(?P<n3>\d+)(?P<s3>[+-])|(?P<s4>\++|-+))\s*$"
+)
+
+
+def _split_charge(formula: str) -> Tuple[str, int]:
+    """
+    Split a formula in the neutral part and the integer charge encoded by its suffix.
     """
-    Check whether a character represents a letter or a number.
+    match = _CHARGE.search(formula)
+    if match is None:
+        return formula, 0
+
+    groups = match.groupdict()
+    if groups["s4"] is not None:
+        sign, number = groups["s4"][0], len(groups["s4"])
+    else:
+        sign = groups["s1"] or groups["s2"] or groups["s3"]
+        number = int(groups["n1"] or groups["n2"] or groups["n3"] or 1)
+
+    return formula[: match.start()], number if sign == "+" else -number
+
+
+def hill_order(elements: Iterable[str]) -> List[str]:
+    """
+    Sort a set of element symbols according to the Hill system: carbon first, hydrogen
+    second and all the other elements in alphabetical order. If carbon is not present
+    all the elements, hydrogen included, are sorted alphabetically.
 
     Arguments
     ---------
-    character: str
-        The string containing the character to be tested.
+    elements: Iterable[str]
+        The element symbols to sort.
 
     Returns
     -------
-    bool
-        True if the character is a letter, False if the character is a number.
+    List[str]
+        The sorted list of symbols.
+    """
+    elements = set(elements)
+    if "C" not in elements:
+        return sorted(elements)
+
+    head = ["C", "H"] if "H" in elements else ["C"]
+    return head + sorted(elements.difference(head))
+
+
+@lru_cache(maxsize=4096)
+def _parse(formula: str) -> Tuple[Tuple[Tuple[str, int], ...], int]:
     """
-    return False if character in "0123456789" else True
+    Parse a formula in a single pass over its tokens returning the canonical composition,
+    as a tuple of (element, number) couples in Hill order, and the charge.
+    """
+    body, charge = _split_charge(formula)
+
+    total = {}
+    stack = [{}]
+    pending, count = None, None
+    multiplier, start, separated = 1, True, False
+
+    def flush():
+        number = 1 if count is None else count
+        if isinstance(pending, str):
+            stack[-1][pending] = stack[-1].get(pending, 0) + number
+        elif pending is not None:
+            for element, n in pending.items():
+                stack[-1][element] = stack[-1].get(element, 0) + number * n
+
+    def close_unit():
+        if len(stack) != 1:
+            raise ValueError(f"Unbalanced brackets in formula '{formula}'")
+        # A unit without atoms (e.g. the `5` in `CuSO4.5`) is only allowed if it is the
+        # whole formula, which is then reported as not containing any atom
+        if stack[0] == {} and separated:
+            raise ValueError(f"Empty unit in formula '{formula}'")
+        for element, n in stack[0].items():
+            total[element] = total.get(element, 0) + multiplier * n
+
+    for match in _TOKENS.finditer(body):
+        kind, value = match.lastgroup, match.group()
+
+        if kind == "space":
+            continue
 
+        elif kind == "number":
+            if start:
+                multiplier = int(value)
+            elif pending is not None and count is None:
+                count = int(value)
+            else:
+                raise ValueError(f"Unexpected number '{value}' in formula '{formula}'")
+            continue
 
-def isupper(character: str) -> bool:
+        elif kind == "invalid":
+            raise ValueError(f"Invalid character '{value}' in formula '{formula}'")
+
+        flush()
+        pending, count = None, None
+
+        if kind == "element":
+            pending = value
+
+        elif kind == "open":
+            stack.append({})
+
+        elif kind == "close":
+            if len(stack) == 1:
+                raise ValueError(f"Unbalanced brackets in formula '{formula}'")
+            pending = stack.pop()
+
+        elif kind == "separator":
+            separated = True
+            close_unit()
+            stack, multiplier, start = [{}], 1, True
+            continue
+
+        start = False
+
+    flush()
+    close_unit()
+
+    composition = tuple(
+        (element, total[element])
+        for element in hill_order(total)
+        if total[element] != 0
+    )
+    if composition == ():
+        raise ValueError(f"The formula '{formula}' does not contain any atom")
+
+    return composition, charge
+
+
+def parse_ion(formula: str) -> Tuple[List[List[Union[str, int]]], int]:
     """
-    Check whether a character is uppercase or not.
+    Parse a brute formula, possibly carrying a charge, returning its canonical composition
+    and the charge. See `parse_formula` for the supported syntax. The charge is given as a
+    suffix (`+`, `^2+`, `+2`, `--`) or after a closing square bracket (`[SO4]2-`). A
+    number directly followed by a sign is always read as an atom count followed by a
+    single charge, as in `NH4+`, so multiple charges must be written as `^2-`, `+2`,
+    `--` or `[SO4]2-`.
 
     Arguments
     ---------
-    character: str
-        The string containing the character to be tested.
+    formula: str
+        The string econding the brute formula of the ion.
 
     Returns
     -------
-    bool
-        True if the character is uppercase else False.
+    Tuple[List[List[Union[str, int]]], int]
+        The composition of the ion, in the same form returned by `parse_formula`, and its
+        integer charge.
+
+    Examples
+    --------
+    >>> parse_ion("NH4+")
+    ([['H', 4], ['N', 1]], 1)
+    >>> parse_ion("SO4^2-")
+    ([['O', 4], ['S', 1]], -2)
+    >>> parse_ion("[SO4]2-")
+    ([['O', 4], ['S', 1]], -2)
+    >>> parse_ion("Fe2+")
+    ([['Fe', 2]], 1)
     """
-    return True if character in "ABCDEFGHIJKLMNOPQRSTUWXYZ" else False
+    composition, charge = _parse(formula)
+    return [list(block) for block in composition], charge
 
 
 def parse_formula(formula: str) -> List[List[Union[str, int]]]:
     """
     Parse a brute formula extracting a list of lists encoding the element (key) type and
-    the number (item) of atoms of that type in the molecule.
+    the number (item) of atoms of that type in the molecule. The formula is read in a single
+    pass and can contain repeated elements (`CH3CH2OH`), groups with multipliers in round,
+    square or curly brackets (`Ca(OH)2`) and hydration/addition units separated by `·`, `.`
+    or `*` with a leading multiplier (`CuSO4·5H2O`). A trailing charge is ignored (see
+    `parse_ion`). The returned composition is canonical: each element appears only once
+    and the elements are sorted according to the Hill system. The results are memoized so
+    that repeated formulas are parsed only once.
 
     Arguments
     ---------
@@ -353,151 +661,1769 @@ def parse_formula(formula: str) -> List[List[Union[str, int]]]:
         The list of lists encoding the composition of the molecule. The first element of each
         couple encodes the element while the values the number of that type of atom in the molecule.
     """
+    return parse_ion(formula)[0]
+
 
-    # Parse the string dividing the atom symbol from the number of
-    # atoms using , and the different atom types with ;
-    new_peaks = ""
-    for i, c in enumerate(formula):
-        # Check if the end of the formula string is reached and copy the last character
-        if i + 1 == len(formula):
-            new_peaks += f"{c}"
+def format_formula(composition: List[List[Union[str, int]]], charge: int = 0) -> str:
+    """
+    Write the canonical brute formula of a composition, merging the repeated elements and
+    sorting them according to the Hill system. Two compositions describing the same
+    molecule always give the same string, which can be used as a key for caching.
 
-        # Detect the switch between characters and numbers to add the proper separator (, or ;)
-        elif ischar(c) != ischar(formula[i + 1]):
-            new_peaks += f"{c};" if not ischar(c) else f"{c},"
+    Arguments
+    ---------
+    composition: List[List[Union[str, int]]]
+        The list of lists encoding the composition of the molecule.
+    charge: int
+        The charge of the molecule (default: 0, neutral).
 
-        # Detect two adjacent element with lower and upper case characters
-        elif not isupper(c) and ischar(formula[i + 1]):
-            new_peaks += f"{c},1;"
+    Returns
+    -------
+    str
+        The canonical brute formula.
+    """
+    counts = {}
+    for element, number in composition:
+        counts[element] = counts.get(element, 0) + number
 
-        # Detect two adjacent uppercase element symbols
-        elif isupper(c) and isupper(formula[i + 1]):
-            new_peaks += f"{c},1;"
+    formula = "".join(
+        element if counts[element] == 1 else f"{element}{counts[element]}"
+        for element in hill_order(counts)
+        if counts[element] != 0
+    )
 
-        else:
-            new_peaks += f"{c}"
+    if charge != 0:
+        sign = "+" if charge > 0 else "-"
+        formula += sign if abs(charge) == 1 else f"^{abs(charge)}{sign}"
 
-    if ischar(new_peaks[-1]):
-        new_peaks += ",1"
+    return formula
 
-    composition = []
-    for field in new_peaks.split(";"):
-        element, number = field.split(",")
-        composition.append([element, int(number)])
 
-    return composition
+def merge(
+    peaks: List[List[float]], equivalent: float = 1e-8, absolute: bool = False
+) -> List[List[float]]:
+    """
+    Merge the peaks with equivalent masses sorting them by mass and sweeping once over the
+    sorted list. Each group starts from its lightest peak and contains the following peaks
+    whose masses differ from it by less than the given threshold, so that a chain of close
+    peaks is never merged beyond the threshold. Each merged peak is placed at the
+    abbundance weighted average of the masses it contains (the original implementation
+    kept the mass of the first peak found) and the returned peaks are sorted by
+    increasing mass.
 
+    Arguments
+    ---------
+    peaks: List[List[float]]
+        The list of lists encoding the mass and abbundance of each peak.
+    equivalent: float
+        The threshold under which the masses are considered equivalent.
+    absolute: bool
+        If set to False (default) the threshold is relative to the mass of the peak (use
+        e.g. `1e-6` for a 1 ppm tolerance) else it is an absolute value in a.m.u.
 
-def process(
-    composition: List[List[Union[str, int]]],
+    Returns
+    -------
+    List[List[float]]
+        The list of lists encoding the mass and abbundance of each merged peak.
+    """
+    merged, limit = [], None
+    for mass, abbundance in sorted(peaks, key=lambda peak: peak[0]):
+        if limit is not None and mass < limit:
+            last = merged[-1]
+            total = last[1] + abbundance
+            last[0] = (last[0] * last[1] + mass * abbundance) / total
+            last[1] = total
+            continue
+
+        merged.append([mass, abbundance])
+        limit = mass + (equivalent if absolute else equivalent * mass)
+
+    return merged
+
+
+def convolve(
+    peaks: List[List[float]],
+    other: List[List[float]],
     equivalent: float = 1e-8,
     dump: float = 1e-12,
-    normalize: bool = False,
+    absolute: bool = False,
 ) -> List[List[float]]:
     """
-    Run an iterative procedure to evaluate all the possible combinations of isotopes
-    masses.
+    Combine two isotope patterns computing all the possible sums of their masses.
+    Both the patterns and the result are expressed in percentage abbundance.
 
     Arguments
     ---------
-    composition: List[List[Union[str, int]]]
-        The disctionary encoding the composition of the molecule.
+    peaks: List[List[float]]
+        The list of lists encoding the mass and percentage abbundance of the first pattern.
+    other: List[List[float]]
+        The list of lists encoding the mass and percentage abbundance of the second pattern.
     equivalent: float
-        The threshold in a.m.u under which the masses are considered equivalent.
+        The threshold under which the masses are considered equivalent (relative by default).
     dump: float
-        The abbundance threshold under which a given combination is discarded.
-    normalize: bool
-        If set to False (default) will return the percentage abbundance else it will
-        set the largest peak to 100.
+        The probability threshold under which a given combination is discarded.
+    absolute: bool
+        If set to True the `equivalent` threshold is an absolute value in a.m.u. instead
+        of being relative to the mass of the peaks.
 
     Returns
     -------
     List[List[float]]
-        The list of lists encoding the mass and abbundance of each peak.
+        The list of lists encoding the mass and percentage abbundance of the combined pattern.
     """
+    peaks = [[mass, abbundance / 100] for mass, abbundance in peaks]
+    other = [[mass, abbundance / 100] for mass, abbundance in other]
 
-    # Start the iterative process from the first element block of the composition
-    element, number = composition[0]
-    reminder = [] if len(composition) == 1 else composition[1::]
-
-    # If the current block contains only one atom pass directly the reminder to the next iteration
-    if number == 1 and reminder != []:
-        new = reminder
-
-    # If the current block contains only one atom and is the last one return its isotopes.
-    elif number == 1:
-        isotopes = ISOTOPES[element]
-        return isotopes
+    return [
+        [mass, 100 * probability]
+        for mass, probability in _convolve(peaks, other, equivalent, dump, absolute)
+    ]
 
-    # If the block is generic pass the composition to the next iteration subtracting one atom form the current block.
-    else:
-        new = [[element, number - 1]]
-        for b in reminder:
-            new.append(b)
-
-    # Call the next iteration on the reduced block
-    peaks = process(new)
 
-    # Obtain all the isotopes of the current element
-    isotopes = ISOTOPES[element]
+def _convolve(peaks, other, equivalent=1e-8, dump=1e-12, absolute=False, profiler=None):
+    """
+    Version of `convolve` operating on patterns expressed as probabilities, used by the
+    pure Python backend. If a `Profiler` is given the statistics of the step are recorded.
+    """
+    if profiler is not None:
+        start = perf_counter()
 
-    # Create a new split combining the mass peaks of the next iteration with the isotopes of the current element.
+    # Create a new split combining the mass peaks of the two patterns
     new_peaks = []
-    for isotope in isotopes:
+    for isotope in other:
         for peak in peaks:
             mass = peak[0] + isotope[0]
-            abbundance = peak[1] * isotope[1] / 100
+            abbundance = peak[1] * isotope[1]
 
             # Drop all the peaks with abbundances lower than the dump threshold
-            if abbundance / 100 < dump:
+            if abbundance < dump or abbundance == 0:
                 continue
 
             # Append the new peak to the list
             new_peaks.append([mass, abbundance])
 
     # Eliminate duplicates of the same mass values
-    peaks = []
-    for peak in new_peaks:
-        masses = [p[0] for p in peaks]
-        for i, mass in enumerate(masses):
-            if abs(peak[0] - mass) / mass < equivalent:
-                peaks[i][1] += peak[1]
+    if profiler is None:
+        return merge(new_peaks, equivalent, absolute)
+
+    middle = perf_counter()
+    merged = merge(new_peaks, equivalent, absolute)
+    profiler._convolution(
+        len(peaks) * len(other),
+        len(new_peaks),
+        sum(peak[1] for peak in peaks) * sum(peak[1] for peak in other)
+        - sum(peak[1] for peak in new_peaks),
+        len(merged),
+        middle - start,
+        perf_counter() - middle,
+    )
+    return merged
+
+
+def _group_starts(masses, equivalent, absolute):
+    """
+    Return the indices of the first peak of each group of equivalent masses, computed as
+    in `merge` on an array of sorted masses. Unless all the chains of close neighbours are
+    narrower than the threshold, the first peak of the group following each peak is found
+    with a binary search and the chain of groups starting from the first
+    peak is then followed by pointer doubling, in a logarithmic number of vectorized steps.
+    """
+    import numpy as np
+
+    limits = masses + (equivalent if absolute else equivalent * masses)
+
+    # If no chain of close neighbours is wider than the threshold the groups are the chains
+    starts = np.flatnonzero(np.concatenate(([True], masses[1:] >= limits[:-1])))
+    stops = np.append(starts[1:], masses.size) - 1
+    if np.all(masses[stops] < limits[starts]):
+        return starts
+
+    following = np.append(np.searchsorted(masses, limits, side="left"), masses.size)
+
+    # After k steps `starts` holds the first 2^k groups and `following` jumps 2^k groups
+    starts = np.zeros(1, dtype=np.intp)
+    while starts[-1] != masses.size:
+        starts = np.union1d(starts, following[starts])
+        following = following[following]
+
+    return starts[:-1]
+
+
+def _convolve_numpy(
+    peaks, other, equivalent=1e-8, dump=1e-12, absolute=False, profiler=None
+):
+    """
+    NumPy version of `convolve` operating on `(masses, probabilities)` couples of arrays.
+    The masses and abbundances of the combinations are obtained as outer sum and outer
+    product of the two patterns and the equivalent masses are merged by sorting the
+    candidates and reducing the contiguous groups of neighbours.
+    """
+    import numpy as np
+
+    if profiler is not None:
+        start = perf_counter()
+
+    masses = np.add.outer(other[0], peaks[0]).ravel()
+    abbundances = np.multiply.outer(other[1], peaks[1]).ravel()
+
+    # Drop all the peaks with abbundances lower than the dump threshold
+    mask = (abbundances >= dump) & (abbundances > 0)
+    masses, abbundances = masses[mask], abbundances[mask]
+
+    if profiler is not None:
+        middle = perf_counter()
+
+    if masses.size != 0:
+        # Eliminate duplicates of the same mass values
+        order = np.argsort(masses, kind="stable")
+        masses, abbundances = masses[order], abbundances[order]
+
+        starts = _group_starts(masses, equivalent, absolute)
+        merged = np.add.reduceat(abbundances, starts)
+        merged = np.add.reduceat(masses * abbundances, starts) / merged, merged
+    else:
+        merged = masses, abbundances
+
+    if profiler is not None:
+        profiler._convolution(
+            peaks[0].size * other[0].size,
+            masses.size,
+            float(peaks[1].sum() * other[1].sum() - abbundances.sum()),
+            merged[0].size,
+            middle - start,
+            perf_counter() - middle,
+        )
+
+    return merged
+
+
+def _prune(peaks, keep=1.0, max_peaks=None):
+    """
+    Keep only the most probable peaks of a pattern, expressed as probabilities, up to a
+    maximum number of peaks and to the given fraction of its total probability. The pruned
+    pattern is returned sorted by mass.
+    """
+    ordered = sorted(peaks, key=lambda peak: -peak[1])
+    if max_peaks is not None:
+        ordered = ordered[:max_peaks]
+
+    if keep < 1:
+        target, covered = keep * sum(peak[1] for peak in peaks), 0.0
+        for i, peak in enumerate(ordered):
+            covered += peak[1]
+            if covered >= target:
+                ordered = ordered[: i + 1]
                 break
+
+    return sorted(ordered, key=lambda peak: peak[0])
+
+
+def _prune_numpy(peaks, keep=1.0, max_peaks=None):
+    """
+    NumPy version of `_prune` operating on `(masses, probabilities)` couples of arrays.
+    """
+    import numpy as np
+
+    masses, abbundances = peaks
+    order = np.argsort(-abbundances, kind="stable")
+    if max_peaks is not None:
+        order = order[:max_peaks]
+
+    if keep < 1:
+        covered = np.cumsum(abbundances[order])
+        order = order[: np.searchsorted(covered, keep * abbundances.sum()) + 1]
+
+    order.sort()
+    return masses[order], abbundances[order]
+
+
+class _Backend(NamedTuple):
+    """
+    The functions used by a backend to build the pattern of a single atom from its
+    `Isotopes`, to convolve two patterns, to prune a pattern, to compute its total
+    probability, to convert it back to a list of lists in percentage abbundance, to
+    count its peaks and to load a pattern given as a list of lists in percentage
+    abbundance.
+    """
+
+    name: str
+    build: Callable
+    combine: Callable
+    prune: Callable
+    total: Callable
+    export: Callable
+    size: Callable
+    load: Callable
+
+
+class _Options(NamedTuple):
+    """
+    The merging and pruning options applied at each convolution step.
+    """
+
+    equivalent: float
+    dump: float
+    absolute: bool
+    keep: float
+    max_peaks: Optional[int]
+
+
+def _get_backend(backend: str) -> _Backend:
+    """
+    Return the functions implementing the selected backend.
+    """
+    if backend == "auto":
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            backend = "python"
         else:
-            peaks.append(peak)
+            backend = "numpy"
 
-    # If required normalize the peaks by the largest one
-    if normalize is True:
-        maximum = max([p[1] for p in peaks])
-        new_peaks = deepcopy(peaks)
-        for i, _ in enumerate(peaks):
-            new_peaks[i][1] *= 100 / maximum
-        return new_peaks
+    if backend == "python":
+        return _Backend(
+            "python",
+            lambda isotopes: [
+                [mass, probability]
+                for mass, probability in zip(isotopes.masses, isotopes.probabilities)
+            ],
+            _convolve,
+            _prune,
+            lambda peaks: sum(peak[1] for peak in peaks),
+            lambda peaks: [[mass, 100 * probability] for mass, probability in peaks],
+            len,
+            lambda peaks: [[mass, abbundance / 100] for mass, abbundance in peaks],
+        )
 
-    return peaks
+    elif backend == "numpy":
+        import numpy as np
 
+        return _Backend(
+            "numpy",
+            lambda isotopes: (
+                np.frombuffer(isotopes.masses),
+                np.frombuffer(isotopes.probabilities),
+            ),
+            _convolve_numpy,
+            _prune_numpy,
+            lambda peaks: float(peaks[1].sum()),
+            lambda peaks: np.column_stack((peaks[0], 100 * peaks[1])).tolist(),
+            lambda peaks: peaks[0].size,
+            lambda peaks: (
+                np.array([peak[0] for peak in peaks], dtype=float),
+                np.array([peak[1] for peak in peaks], dtype=float) / 100,
+            ),
+        )
 
-if __name__ == "__main__":
-    formula = input("Enter the brute formula of the compound: ")
+    raise ValueError(f"Unknown backend '{backend}'")
 
-    composition = parse_formula(formula)
-    peaks = process(composition, normalize=True)
 
-    masses = [peak[0] for peak in peaks]
-    intensities = [peak[1] for peak in peaks]
+class PatternCache:
+    """
+    Bounded cache of the element block patterns computed by `process`. The patterns are
+    stored for each combination of element, number of atoms, merging and pruning options,
+    backend and isotope table fingerprint, so that patterns obtained with a custom isotope
+    table are never mixed with the ones obtained with the default one.
 
-    print("\n  Mass (amu) | Intensity  ")
-    print("--------------------------")
-    for mass, intensity in zip(masses, intensities):
-        print("{0:>12} | {1:>6}".format(f"{mass:.6f}", f"{intensity:.4e}"))
+    Arguments
+    ---------
+    maxsize: Optional[int]
+        The maximum number of patterns stored in the cache (default: 256). If set to None
+        the cache is unbounded.
+    policy: str
+        The eviction policy applied once the cache is full: `lru` (default) discards the
+        least recently used pattern while `fifo` discards the oldest stored one.
+    """
 
-    plt.figure(figsize=(8, 5))
+    def __init__(self, maxsize: Optional[int] = 256, policy: str = "lru") -> None:
+        if policy not in ("lru", "fifo"):
+            raise ValueError(f"Unknown eviction policy '{policy}'")
 
-    plt.stem(masses, intensities, basefmt="none", markerfmt="none")
-    plt.ylim([0, 105])
+        self.__maxsize = maxsize
+        self.__policy = policy
+        self.__patterns = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    plt.xlabel("Mass [amu]")
-    plt.ylabel("Intensity [a.u.]")
+    def __len__(self) -> int:
+        return len(self.__patterns)
+
+    @property
+    def maxsize(self) -> Optional[int]:
+        return self.__maxsize
+
+    @maxsize.setter
+    def maxsize(self, value: Optional[int]) -> None:
+        self.__maxsize = value
+        self.__evict()
+
+    @property
+    def policy(self) -> str:
+        return self.__policy
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the pattern stored for the given key or None if the key is not in the cache.
+        """
+        try:
+            pattern = self.__patterns[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if self.__policy == "lru":
+            self.__patterns.move_to_end(key)
+
+        return pattern
+
+    def put(self, key: Hashable, pattern: Any) -> None:
+        """
+        Store a pattern in the cache evicting the older entries if the cache is full.
+        """
+        self.__patterns[key] = pattern
+        self.__evict()
+
+    def clear(self) -> None:
+        """
+        Remove all the stored patterns and reset the statistics.
+        """
+        self.__patterns.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a dictionary with the hit/miss statistics and the size of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.__patterns),
+            "maxsize": self.__maxsize,
+            "policy": self.__policy,
+        }
+
+    def __evict(self) -> None:
+        if self.__maxsize is None:
+            return
+
+        while len(self.__patterns) > self.__maxsize:
+            self.__patterns.popitem(last=False)
+            self.evictions += 1
+
+
+# The cache of the element block patterns shared by default by all the `process` calls
+ELEMENT_CACHE = PatternCache()
+
+
+def _check_counts(composition: List[List[Union[str, int]]]) -> None:
+    """
+    Raise a ValueError if a composition contains a negative number of atoms, which would
+    never terminate the repeated squaring of the element blocks.
+    """
+    for element, number in composition:
+        if number < 0:
+            raise ValueError(
+                f"Negative number of atoms ({number}) of element '{element}'"
+            )
+
+
+def _steps(composition: List[List[Union[str, int]]]) -> Tuple[int, int]:
+    """
+    Count the number of convolutions required to compute the pattern of a composition by
+    repeated squaring of each element block, together with the number of times the result
+    of each step enters the final pattern: the power C^(2^k) of a block of n atoms enters
+    the final pattern n // 2^k times, while the other steps enter it only once.
+    """
+    steps, weight, blocks = 0, 0, 0
+    for _, number in composition:
+        if number != 0:
+            multiplications = bin(number).count("1") - 1
+            squarings = number.bit_length() - 1
+            steps += squarings + multiplications
+            weight += (
+                sum(number >> k for k in range(1, squarings + 1)) + multiplications
+            )
+            blocks += 1
+
+    blocks = max(blocks - 1, 0)
+    return steps + blocks, weight + blocks
+
+
+def _options(equivalent, dump, absolute, coverage, max_peaks, weight) -> _Options:
+    """
+    Build the options of each convolution step. Since the probability retained by a
+    convolution is the product of the ones retained by its factors, keeping the fraction
+    `coverage ** (1 / weight)` at each step, where `weight` counts how many times the
+    steps enter the final pattern, guarantees that at least `coverage` is retained overall.
+    """
+    if not 0 < coverage <= 1:
+        raise ValueError("The coverage must be in the (0, 1] interval")
+
+    if max_peaks is not None and max_peaks < 1:
+        raise ValueError("The maximum number of peaks must be at least 1")
+
+    keep = 1.0 if coverage == 1 or weight == 0 else coverage ** (1 / weight)
+    return _Options(equivalent, dump, absolute, keep, max_peaks)
+
+
+def _combine(
+    backend: _Backend, peaks, other, options: _Options, profiler=None, label=None
+):
+    """
+    Convolve two patterns and prune the result according to the given options. If a
+    `Profiler` is given the statistics of the step are recorded under the given label.
+    """
+    if profiler is None:
+        new = backend.combine(
+            peaks, other, options.equivalent, options.dump, options.absolute
+        )
+        if options.keep < 1 or options.max_peaks is not None:
+            new = backend.prune(new, options.keep, options.max_peaks)
+
+        return new
+
+    new = backend.combine(
+        peaks, other, options.equivalent, options.dump, options.absolute, profiler
+    )
+
+    start, before = perf_counter(), backend.total(new)
+    if options.keep < 1 or options.max_peaks is not None:
+        new = backend.prune(new, options.keep, options.max_peaks)
+
+    elapsed = perf_counter() - start
+    profiler._pruning(label, before - backend.total(new), backend.size(new), elapsed)
+    return new
+
+
+def _element_pattern(
+    element, number, options, backend, cache, table, advance=None, profiler=None
+):
+    """
+    Compute the pattern of an element block, in the representation of a given backend, by
+    repeated squaring of the single atom pattern, reusing the cached one if available. If
+    given, `advance` is called after each convolution step and the statistics of each
+    step are recorded by `profiler`.
+    """
+    if cache is True:
+        cache = ELEMENT_CACHE
+    elif cache is False:
+        cache = None
+
+    if cache is not None:
+        key = (element, number, options, backend.name, table.fingerprint)
+
+        pattern = cache.get(key)
+        if pattern is not None:
+            if profiler is not None:
+                profiler.cache_hits += 1
+            return pattern
+
+    # Start from the isotopes of the element (C^1) and square them at each step (C^2, C^4, ...)
+    power = backend.build(table[element])
+    pattern = None
+    exponent, total = 1, 0
+
+    while True:
+        # Multiply the current power in the pattern if the corresponding bit is set
+        if number & 1:
+            if pattern is None:
+                pattern = power
+            else:
+                label = (
+                    None
+                    if profiler is None
+                    else f"{element}{total}*{element}{exponent}"
+                )
+                pattern = _combine(backend, pattern, power, options, profiler, label)
+                if advance is not None:
+                    advance()
+            total += exponent
+
+        number >>= 1
+        if number == 0:
+            break
+
+        label = None if profiler is None else f"{element}{exponent}^2"
+        power = _combine(backend, power, power, options, profiler, label)
+        exponent *= 2
+        if advance is not None:
+            advance()
+
+    if cache is not None:
+        cache.put(key, pattern)
+
+    return pattern
+
+
+class PruningReport(NamedTuple):
+    """
+    Summary of the pruning applied by `process`.
+
+    Attributes
+    ----------
+    discarded: float
+        The total probability (0 to 1) discarded by all the pruning criteria.
+    steps: int
+        The number of convolution steps performed.
+    keep: float
+        The fraction of probability retained by the coverage pruning at each step.
+    peaks: int
+        The number of peaks in the final pattern.
+    """
+
+    discarded: float
+    steps: int
+    keep: float
+    peaks: int
+
+
+class StepStats(NamedTuple):
+    """
+    Statistics of a single convolution step collected by a `Profiler`.
+
+    Attributes
+    ----------
+    label: str
+        The description of the step (e.g. `C4^2` for the squaring of a block of 4 carbon
+        atoms, `C8*C32` for the product of two blocks or `C*H` for the combination of
+        the blocks of different elements).
+    candidates: int
+        The number of combinations of the peaks of the two patterns.
+    dumped: int
+        The number of combinations discarded by the `dump` threshold.
+    dumped_probability: float
+        The probability discarded by the `dump` threshold.
+    merges: int
+        The number of peaks merged into an equivalent one.
+    peaks: int
+        The number of peaks after the merging.
+    pruned_probability: float
+        The probability discarded by the coverage and `max_peaks` pruning.
+    kept: int
+        The number of peaks kept at the end of the step.
+    """
+
+    label: str
+    candidates: int
+    dumped: int
+    dumped_probability: float
+    merges: int
+    peaks: int
+    pruned_probability: float
+    kept: int
+
+
+class Profiler:
+    """
+    Opt-in collector of the timing and of the statistics of each convolution step of
+    `process`. When no profiler is given, no timing or counting is performed.
+
+    Attributes
+    ----------
+    steps: List[StepStats]
+        The statistics of each convolution step, in the order in which they are performed.
+    timings: Dict[str, float]
+        The total time in seconds spent computing the combinations (`convolve`), merging
+        the equivalent masses (`merge`), pruning (`prune`) and converting and normalizing
+        the final pattern (`normalize`).
+    cache_hits: int
+        The number of element block patterns taken from the cache.
+    """
+
+    def __init__(self) -> None:
+        self.steps = []
+        self.timings = {"convolve": 0.0, "merge": 0.0, "prune": 0.0, "normalize": 0.0}
+        self.cache_hits = 0
+        self.__pending = None
+
+    def _convolution(self, candidates, generated, dumped, peaks, convolve, merge):
+        # Called by the backends once the combinations have been generated and merged
+        self.timings["convolve"] += convolve
+        self.timings["merge"] += merge
+        self.__pending = (
+            candidates,
+            candidates - generated,
+            max(dumped, 0.0),
+            generated - peaks,
+            peaks,
+        )
+
+    def _pruning(self, label, pruned, kept, elapsed):
+        # Called by `_combine` once the result of the convolution has been pruned
+        self.timings["prune"] += elapsed
+        self.steps.append(StepStats(label, *self.__pending, pruned, kept))
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Return a dictionary with the timings and the totals of the step statistics.
+        """
+        return {
+            "steps": len(self.steps),
+            "cache_hits": self.cache_hits,
+            "timings": dict(self.timings),
+            "candidates": sum(step.candidates for step in self.steps),
+            "dumped": sum(step.dumped for step in self.steps),
+            "dumped_probability": sum(step.dumped_probability for step in self.steps),
+            "merges": sum(step.merges for step in self.steps),
+            "pruned_probability": sum(step.pruned_probability for step in self.steps),
+            "max_peaks": max((step.kept for step in self.steps), default=0),
+        }
 
-    plt.savefig(f"exact_mass_{formula}.png", dpi=600)
-    plt.show()
+    def report(self) -> str:
+        """
+        Return a printable table of the statistics of each step followed by the timings.
+        """
+        lines = [
+            f"{'Step':>16} | {'Candidates':>10} | {'Dumped':>8} | {'Dumped P':>9} | "
+            f"{'Merges':>8} | {'Pruned P':>9} | {'Kept':>7}",
+            "-" * 86,
+        ]
+        for step in self.steps:
+            lines.append(
+                f"{step.label:>16} | {step.candidates:>10} | {step.dumped:>8} | "
+                f"{step.dumped_probability:>9.2e} | {step.merges:>8} | "
+                f"{step.pruned_probability:>9.2e} | {step.kept:>7}"
+            )
+
+        lines.append(f"Element blocks taken from the cache: {self.cache_hits}")
+        lines.append(
+            "Time (ms): "
+            + ", ".join(
+                f"{stage} {1000 * elapsed:.3f}"
+                for stage, elapsed in self.timings.items()
+            )
+        )
+        return "\n".join(lines)
+
+
+def element_pattern(
+    element: str,
+    number: int,
+    equivalent: float = 1e-8,
+    dump: float = 1e-12,
+    absolute: bool = False,
+    backend: str = "python",
+    cache: Union[bool, PatternCache] = True,
+    table: Optional[IsotopeTable] = None,
+    coverage: float = 1.0,
+    max_peaks: Optional[int] = None,
+    profiler: Optional[Profiler] = None,
+) -> List[List[float]]:
+    """
+    Compute the isotope pattern of a block of identical atoms by repeated squaring of the
+    single atom pattern so that only O(log(number)) convolutions are required.
+
+    Arguments
+    ---------
+    element: str
+        The symbol of the element composing the block.
+    number: int
+        The number of atoms in the block.
+    equivalent: float
+        The threshold under which the masses are considered equivalent (relative by default).
+    dump: float
+        The probability threshold under which a given combination is discarded.
+    absolute: bool
+        If set to True the `equivalent` threshold is an absolute value in a.m.u. instead
+        of being relative to the mass of the peaks.
+    backend: str
+        The backend used to compute the convolutions: `python` (default), `numpy` or
+        `auto` (use NumPy if available).
+    cache: Union[bool, PatternCache]
+        The cache of element block patterns to use. If set to True (default) the shared
+        `ELEMENT_CACHE` is used while False disables caching.
+    table: Optional[IsotopeTable]
+        The isotope table to use. If None (default) the table built from `ISOTOPES` is used.
+    coverage: float
+        The minimum fraction of the total probability retained by the pruning of the
+        intermediate steps (see `process`).
+    max_peaks: Optional[int]
+        The maximum number of peaks kept after each convolution step.
+    profiler: Optional[Profiler]
+        If given, the profiler collecting the statistics of each convolution step.
+
+    Returns
+    -------
+    List[List[float]]
+        The list of lists encoding the mass and percentage abbundance of each peak.
+    """
+    _check_counts([[element, number]])
+    backend = _get_backend(backend)
+    _, weight = _steps([[element, number]])
+    options = _options(equivalent, dump, absolute, coverage, max_peaks, weight)
+    pattern = _element_pattern(
+        element, number, options, backend, cache, get_table(table), None, profiler
+    )
+    return backend.export(pattern)
+
+
+def _normalized(peaks: List[List[float]]) -> List[List[float]]:
+    """
+    Return a copy of the peaks normalized so that the largest one is 100.
+    """
+    maximum = max([p[1] for p in peaks])
+    new_peaks = deepcopy(peaks)
+    for i, _ in enumerate(peaks):
+        new_peaks[i][1] *= 100 / maximum
+    return new_peaks
+
+
+def process(
+    composition: List[List[Union[str, int]]],
+    equivalent: float = 1e-8,
+    dump: float = 1e-12,
+    normalize: bool = False,
+    absolute: bool = False,
+    backend: str = "python",
+    cache: Union[bool, PatternCache] = True,
+    table: Optional[IsotopeTable] = None,
+    coverage: float = 1.0,
+    max_peaks: Optional[int] = None,
+    report: bool = False,
+    progress: Optional[Callable[[int, int], None]] = None,
+    profiler: Optional[Profiler] = None,
+) -> Union[List[List[float]], Tuple[List[List[float]], PruningReport]]:
+    """
+    Run an iterative procedure to evaluate all the possible combinations of isotopes
+    masses. The pattern of each element block is computed by repeated squaring, or taken
+    from the cache of element block patterns, and the blocks are then combined together.
+    All the merging and pruning options are applied at every convolution step.
+
+    Arguments
+    ---------
+    composition: List[List[Union[str, int]]]
+        The disctionary encoding the composition of the molecule.
+    equivalent: float
+        The threshold under which the masses are considered equivalent (relative by default).
+    dump: float
+        The probability threshold under which a given combination is discarded.
+    normalize: bool
+        If set to False (default) will return the percentage abbundance else it will
+        set the largest peak to 100.
+    absolute: bool
+        If set to True the `equivalent` threshold is an absolute value in a.m.u. instead
+        of being relative to the mass of the peaks.
+    backend: str
+        The backend used to compute the convolutions: `python` (default) for the pure
+        Python implementation, `numpy` for the vectorized NumPy one or `auto` to use NumPy
+        only if it is installed.
+    cache: Union[bool, PatternCache]
+        The cache of element block patterns to use. If set to True (default) the shared
+        `ELEMENT_CACHE` is used while False disables caching.
+    table: Optional[IsotopeTable]
+        The isotope table to use. If None (default) the table built from `ISOTOPES` is used.
+    coverage: float
+        The minimum fraction of the total probability retained by the pruning. At each step
+        only the most probable peaks covering a fixed fraction of the probability are kept,
+        chosen so that the final pattern covers at least `coverage` of the total (up to the
+        additional probability discarded by `dump` and `max_peaks`). By default (1.0) no
+        coverage pruning is applied.
+    max_peaks: Optional[int]
+        The maximum number of peaks kept after each convolution step, bounding the memory
+        and time required by large formulas. By default (None) the number is not limited.
+    report: bool
+        If set to True a `PruningReport` with the discarded probability is also returned.
+    progress: Optional[Callable[[int, int], None]]
+        If given, a function called with the number of convolution steps completed and
+        the total number of steps as the computation proceeds. The computation can be
+        aborted by raising an exception from it, which is propagated to the caller.
+    profiler: Optional[Profiler]
+        If given, the `Profiler` collecting the timing of each stage and the statistics
+        of each convolution step. By default (None) no statistics are collected.
+
+    Returns
+    -------
+    Union[List[List[float]], Tuple[List[List[float]], PruningReport]]
+        The list of lists encoding the mass and abbundance of each peak and, if required,
+        the report of the pruning.
+    """
+    _check_counts(composition)
+    backend = _get_backend(backend)
+    table = get_table(table)
+
+    steps, weight = _steps(composition)
+    options = _options(equivalent, dump, absolute, coverage, max_peaks, weight)
+
+    done = 0
+
+    def advance():
+        nonlocal done
+        done += 1
+        progress(done, steps)
+
+    # Combine the patterns of the element blocks one after the other
+    peaks, name = None, ""
+    for element, number in composition:
+        if number == 0:
+            continue
+
+        # The steps of a cached block are counted as completed all at once
+        start = done
+        block = _element_pattern(
+            element,
+            number,
+            options,
+            backend,
+            cache,
+            table,
+            None if progress is None else advance,
+            profiler,
+        )
+        done = start + _steps([[element, number]])[0]
+
+        if peaks is None:
+            peaks = block
+        else:
+            label = None if profiler is None else f"{name}*{element}{number}"
+            peaks = _combine(backend, peaks, block, options, profiler, label)
+            if progress is not None:
+                advance()
+
+        if profiler is not None:
+            name += f"{element}{number}"
+
+    if peaks is None:
+        raise ValueError("The composition does not contain any atom")
+
+    if progress is not None:
+        progress(steps, steps)
+
+    if profiler is not None:
+        start = perf_counter()
+
+    discarded = max(0.0, 1 - backend.total(peaks))
+    peaks = backend.export(peaks)
+
+    # If required normalize the peaks by the largest one
+    if normalize is True:
+        peaks = _normalized(peaks)
+
+    if profiler is not None:
+        profiler.timings["normalize"] += perf_counter() - start
+
+    if report is True:
+        return peaks, PruningReport(discarded, steps, options.keep, len(peaks))
+
+    return peaks
+
+
+def _pattern(composition, options, backend, cache, table):
+    """
+    Compute the pattern of a composition, in the representation of a given backend,
+    combining the patterns of its element blocks. None is returned if the composition
+    does not contain any atom.
+    """
+    peaks = None
+    for element, number in composition:
+        if number == 0:
+            continue
+
+        block = _element_pattern(element, number, options, backend, cache, table)
+        peaks = block if peaks is None else _combine(backend, peaks, block, options)
+
+    return peaks
+
+
+def extend(
+    peaks: List[List[float]],
+    delta: List[List[Union[str, int]]],
+    equivalent: float = 1e-8,
+    dump: float = 1e-12,
+    normalize: bool = False,
+    absolute: bool = False,
+    backend: str = "python",
+    cache: Union[bool, PatternCache] = True,
+    table: Optional[IsotopeTable] = None,
+    coverage: float = 1.0,
+    max_peaks: Optional[int] = None,
+) -> List[List[float]]:
+    """
+    Extend an existing isotope pattern by the atoms of a delta composition, convolving in
+    only the pattern of the delta instead of recomputing the whole molecule (e.g. to add
+    a residue to a peptide).
+
+    Arguments
+    ---------
+    peaks: List[List[float]]
+        The list of lists encoding the mass and percentage abbundance of each peak of the
+        pattern to extend (as returned by `process` with `normalize=False`).
+    delta: List[List[Union[str, int]]]
+        The composition of the atoms added to the molecule. Atoms cannot be removed from
+        a pattern, so negative numbers of atoms raise a ValueError.
+    equivalent: float
+        The threshold under which the masses are considered equivalent (relative by default).
+    dump: float
+        The probability threshold under which a given combination is discarded.
+    normalize: bool
+        If set to False (default) will return the percentage abbundance else it will
+        set the largest peak to 100.
+    absolute: bool
+        If set to True the `equivalent` threshold is an absolute value in a.m.u. instead
+        of being relative to the mass of the peaks.
+    backend: str
+        The backend used to compute the convolutions: `python` (default), `numpy` or
+        `auto` (use NumPy if available).
+    cache: Union[bool, PatternCache]
+        The cache of element block patterns to use. If set to True (default) the shared
+        `ELEMENT_CACHE` is used while False disables caching.
+    table: Optional[IsotopeTable]
+        The isotope table to use. If None (default) the table built from `ISOTOPES` is used.
+    coverage: float
+        The minimum fraction of the probability of the given pattern retained by the
+        pruning of the steps of the extension (see `process`).
+    max_peaks: Optional[int]
+        The maximum number of peaks kept after each convolution step.
+
+    Returns
+    -------
+    List[List[float]]
+        The list of lists encoding the mass and abbundance of each peak of the extended
+        pattern.
+    """
+    _check_counts(delta)
+    backend = _get_backend(backend)
+    table = get_table(table)
+
+    # The steps of the delta pattern and its convolution with the given pattern
+    options = _options(
+        equivalent, dump, absolute, coverage, max_peaks, _steps(delta)[1] + 1
+    )
+
+    other = _pattern(delta, options, backend, cache, table)
+    if other is None:
+        raise ValueError("The delta composition does not contain any atom")
+
+    extended = backend.export(_combine(backend, backend.load(peaks), other, options))
+    return _normalized(extended) if normalize else extended
+
+
+def series(
+    base: List[List[Union[str, int]]],
+    unit: List[List[Union[str, int]]],
+    n: int,
+    equivalent: float = 1e-8,
+    dump: float = 1e-12,
+    normalize: bool = False,
+    absolute: bool = False,
+    backend: str = "python",
+    cache: Union[bool, PatternCache] = True,
+    table: Optional[IsotopeTable] = None,
+    coverage: float = 1.0,
+    max_peaks: Optional[int] = None,
+) -> Iterator[Tuple[int, List[List[float]]]]:
+    """
+    Compute the isotope patterns of the members of a homologous or polymer series, with
+    composition `base + k * unit` for k going from 1 to n (e.g. the `(C2H4O)n` ladder).
+    The pattern of the unit is computed once and each member is obtained convolving it
+    with the pattern of the previous one. The same merging and pruning options are used
+    at every step of the chain, chosen so that each member retains at least `coverage`
+    of the total probability.
+
+    Arguments
+    ---------
+    base: List[List[Union[str, int]]]
+        The composition of the end groups of the series (it can be empty).
+    unit: List[List[Union[str, int]]]
+        The composition of the repeating unit.
+    n: int
+        The number of units of the last member of the series.
+    equivalent: float
+        The threshold under which the masses are considered equivalent (relative by default).
+    dump: float
+        The probability threshold under which a given combination is discarded.
+    normalize: bool
+        If set to False (default) will return the percentage abbundance else it will
+        set the largest peak to 100.
+    absolute: bool
+        If set to True the `equivalent` threshold is an absolute value in a.m.u. instead
+        of being relative to the mass of the peaks.
+    backend: str
+        The backend used to compute the convolutions: `python` (default), `numpy` or
+        `auto` (use NumPy if available).
+    cache: Union[bool, PatternCache]
+        The cache of element block patterns to use. If set to True (default) the shared
+        `ELEMENT_CACHE` is used while False disables caching.
+    table: Optional[IsotopeTable]
+        The isotope table to use. If None (default) the table built from `ISOTOPES` is used.
+    coverage: float
+        The minimum fraction of the total probability retained by the pruning of each
+        member of the series (see `process`).
+    max_peaks: Optional[int]
+        The maximum number of peaks kept after each convolution step.
+
+    Returns
+    -------
+    Iterator[Tuple[int, List[List[float]]]]
+        The number of units and the list of lists encoding the mass and abbundance of each
+        peak of every member of the series, in order of increasing size.
+    """
+    if n < 1:
+        raise ValueError("The series must contain at least one member")
+
+    _check_counts(base)
+    _check_counts(unit)
+
+    backend = _get_backend(backend)
+    table = get_table(table)
+
+    # The last member enters the base once and the unit n times, each through a step
+    base_weight, unit_weight = _steps(base)[1], _steps(unit)[1]
+    weight = (
+        base_weight
+        + n * (unit_weight + 1)
+        - (0 if any(number for _, number in base) else 1)
+    )
+    options = _options(equivalent, dump, absolute, coverage, max_peaks, weight)
+
+    other = _pattern(unit, options, backend, cache, table)
+    if other is None:
+        raise ValueError("The unit composition does not contain any atom")
+
+    peaks = _pattern(base, options, backend, cache, table)
+    for k in range(1, n + 1):
+        peaks = other if peaks is None else _combine(backend, peaks, other, options)
+
+        member = backend.export(peaks)
+        yield k, _normalized(member) if normalize else member
+
+
+class MassSummary(NamedTuple):
+    """
+    The masses and moments of the isotope distribution of a molecule.
+
+    Attributes
+    ----------
+    monoisotopic: float
+        The mass of the molecule composed by the most abundant isotope of each element.
+    nominal: int
+        The sum of the integer masses of the most abundant isotope of each element.
+    average: float
+        The average mass, i.e. the mean of the isotope distribution.
+    variance: float
+        The variance of the isotope distribution in amu^2.
+    """
+
+    monoisotopic: float
+    nominal: int
+    average: float
+    variance: float
+
+
+def _element_moments(
+    table: IsotopeTable, element: str
+) -> Tuple[float, int, float, float]:
+    """
+    Return the monoisotopic mass, the nominal mass, the average mass and the variance of
+    the mass of a single atom of an element.
+    """
+    isotopes = table[element]
+    average = sum(m * p for m, p in zip(isotopes.masses, isotopes.probabilities))
+    variance = sum(
+        p * (m - average) ** 2 for m, p in zip(isotopes.masses, isotopes.probabilities)
+    )
+    return isotopes.masses[0], round(isotopes.masses[0]), average, variance
+
+
+def mass_summary(
+    composition: List[List[Union[str, int]]], table: Optional[IsotopeTable] = None
+) -> MassSummary:
+    """
+    Compute in closed form the monoisotopic, nominal and average mass of a molecule and the
+    variance of its isotope distribution. Since the atoms are independent, the mean and
+    variance of the distribution are the sums of the ones of each atom, so that only a
+    number of operations proportional to the number of elements is required.
+
+    Arguments
+    ---------
+    composition: List[List[Union[str, int]]]
+        The list of lists encoding the composition of the molecule.
+    table: Optional[IsotopeTable]
+        The isotope table to use. If None (default) the table built from `ISOTOPES` is used.
+
+    Returns
+    -------
+    MassSummary
+        The masses and moments of the isotope distribution.
+    """
+    table = get_table(table)
+
+    monoisotopic, nominal, average, variance = 0.0, 0, 0.0, 0.0
+    for element, number in composition:
+        m, n, a, v = _element_moments(table, element)
+        monoisotopic += number * m
+        nominal += number * n
+        average += number * a
+        variance += number * v
+
+    return MassSummary(monoisotopic, nominal, average, variance)
+
+
+def mass_summaries(
+    compositions: Union[Sequence[List[List[Union[str, int]]]], Any],
+    elements: Optional[Sequence[str]] = None,
+    table: Optional[IsotopeTable] = None,
+) -> MassSummary:
+    """
+    Vectorized version of `mass_summary` computing the masses and moments of many molecules
+    at once with a single matrix product between the counts of the atoms and the
+    properties of the elements (requires NumPy).
+
+    Arguments
+    ---------
+    compositions: Union[Sequence[List[List[Union[str, int]]]], np.ndarray]
+        The list of compositions or, if `elements` is given, a (molecules, elements) array
+        with the number of atoms of each element in each molecule.
+    elements: Optional[Sequence[str]]
+        The elements corresponding to the columns of the array of counts.
+    table: Optional[IsotopeTable]
+        The isotope table to use. If None (default) the table built from `ISOTOPES` is used.
+
+    Returns
+    -------
+    MassSummary
+        The summary in which each field is an array with one value per molecule.
+    """
+    import numpy as np
+
+    table = get_table(table)
+
+    if elements is None:
+        columns = {}
+        for composition in compositions:
+            for element, _ in composition:
+                columns.setdefault(element, len(columns))
+
+        counts = np.zeros((len(compositions), len(columns)))
+        for i, composition in enumerate(compositions):
+            for element, number in composition:
+                counts[i, columns[element]] += number
+
+        elements = list(columns)
+    else:
+        counts = np.asarray(compositions, dtype=float).reshape(-1, len(elements))
+
+    properties = np.array(
+        [_element_moments(table, element) for element in elements], dtype=float
+    ).reshape(-1, 4)
+    monoisotopic, nominal, average, variance = (counts @ properties).T
+
+    return MassSummary(monoisotopic, nominal.round().astype(int), average, variance)
+
+
+def _iter_configurations(
+    isotopes: Isotopes, number: int
+) -> Iterator[Tuple[float, float]]:
+    """
+    Walk the multinomial isotope configurations of a block of identical atoms starting from
+    the most probable one and yield their log-probability and mass in descending probability
+    order. Since the multinomial distribution is log-concave every configuration other than
+    the mode has a more probable neighbour, obtained moving a single atom. Taking as parent
+    of each configuration its best neighbour (ranking by probability and then by the
+    configuration itself, so that the ranking is strict) the configurations form a tree
+    rooted at the mode in which the probability never increases going down, so a
+    best-first visit of the tree gives the configurations in the correct order. Each
+    configuration is pushed only by its parent, so that no set of visited configurations
+    is required and the memory is bounded by the size of the priority queue.
+    """
+    masses, logprobs = isotopes.masses, isotopes.log_probabilities
+    offset = lgamma(number + 1)
+
+    def rank(configuration):
+        return (
+            offset
+            + sum(n * lp - lgamma(n + 1) for n, lp in zip(configuration, logprobs)),
+            configuration,
+        )
+
+    def neighbours(configuration):
+        for i, n in enumerate(configuration):
+            if n == 0:
+                continue
+            for j in range(len(configuration)):
+                if j != i:
+                    new = list(configuration)
+                    new[i] -= 1
+                    new[j] += 1
+                    yield tuple(new)
+
+    def is_parent(configuration, key, child):
+        # The configuration is the parent of the child if it is better than the child and
+        # than all the other neighbours of the child. The log-probability of each other
+        # neighbour is first estimated from the one of the child and is computed exactly,
+        # so that the ranking does not depend on the path, only if it is close to the
+        # one of the configuration
+        lp = rank(child)[0]
+        if (lp, child) >= key:
+            return False
+
+        for i, n in enumerate(child):
+            if n == 0:
+                continue
+            for j, m in enumerate(child):
+                if j == i:
+                    continue
+                estimate = lp + log(n / (m + 1)) + logprobs[j] - logprobs[i]
+                if estimate < key[0] - 1e-9:
+                    continue
+                if estimate > key[0] + 1e-9:
+                    return False
+
+                other = list(child)
+                other[i] -= 1
+                other[j] += 1
+                other = tuple(other)
+                if other != configuration and rank(other) > key:
+                    return False
+
+        return True
+
+    # Guess the mode from the expected number of atoms of each isotope and refine it
+    expected = [number * probability for probability in isotopes.probabilities]
+    mode = [int(n) for n in expected]
+    ranking = sorted(range(len(mode)), key=lambda i: mode[i] - expected[i])
+    for i in ranking[: number - sum(mode)]:
+        mode[i] += 1
+
+    mode = tuple(mode)
+    while True:
+        candidate = max(neighbours(mode), key=rank, default=mode)
+        if rank(candidate) <= rank(mode):
+            break
+        mode = candidate
+
+    # Visit the tree of the configurations in best-first order using a priority queue
+    frontier = [(-rank(mode)[0], mode)]
+    while frontier:
+        lp, configuration = heapq.heappop(frontier)
+        yield -lp, sum(n * m for n, m in zip(configuration, masses))
+
+        key = (-lp, configuration)
+        for neighbour in neighbours(configuration):
+            if is_parent(configuration, key, neighbour):
+                heapq.heappush(frontier, (-rank(neighbour)[0], neighbour))
+
+
+class _LazyConfigurations:
+    """
+    Random access view over the configurations of an element block that pulls them from
+    the underlying generator only when they are first requested. The configurations are
+    kept from the first index still in use, set by `release`, to the deepest requested.
+    """
+
+    def __init__(self, isotopes: Isotopes, number: int) -> None:
+        self.__iterator = _iter_configurations(isotopes, number)
+        self.__items = []
+        self.__start = 0
+
+    def get(self, index: int) -> Optional[Tuple[float, float]]:
+        while self.__start + len(self.__items) <= index:
+            item = next(self.__iterator, None)
+            if item is None:
+                return None
+            self.__items.append(item)
+
+        return self.__items[index - self.__start]
+
+    def release(self, index: int) -> None:
+        """
+        Discard the configurations before the given index, which will not be requested.
+        """
+        if index > self.__start:
+            del self.__items[: index - self.__start]
+            self.__start = index
+
+
+def iter_peaks(
+    composition: List[List[Union[str, int]]],
+    coverage: float = 1.0,
+    table: Optional[IsotopeTable] = None,
+) -> Iterator[List[float]]:
+    """
+    Lazily enumerate the isotopologues of a molecule in descending order of probability.
+    The configurations of each element block are generated most-probable-first and their
+    combinations are visited with a priority queue, in which each combination is pushed
+    only by a single parent so that no set of visited combinations is kept. The memory
+    required is bounded by the size of the queue and by the configurations of each block
+    between the lowest and the highest index it references, since the configurations
+    of the blocks that can no longer be requested are periodically discarded.
+
+    Arguments
+    ---------
+    composition: List[List[Union[str, int]]]
+        The list of lists encoding the composition of the molecule.
+    coverage: float
+        The fraction of the total probability after which the enumeration is stopped. By
+        default (1.0) all the isotopologues are generated.
+    table: Optional[IsotopeTable]
+        The isotope table to use. If None (default) the table built from `ISOTOPES` is used.
+
+    Returns
+    -------
+    Iterator[List[float]]
+        The iterator over the mass and percentage abbundance of each isotopologue.
+    """
+
+    # Group the blocks of the same element together
+    counts = {}
+    for element, number in composition:
+        if number != 0:
+            counts[element] = counts.get(element, 0) + number
+
+    if counts == {}:
+        raise ValueError("The composition does not contain any atom")
+
+    table = get_table(table)
+    blocks = [
+        _LazyConfigurations(table[element], number)
+        for element, number in counts.items()
+    ]
+
+    # Each combination of indices is generated by a single parent obtained decrementing its
+    # last non-zero index, so that no visited set is required to avoid duplicates.
+    first = [block.get(0) for block in blocks]
+    start = tuple(0 for _ in blocks)
+    frontier = [(-sum(item[0] for item in first), start, first)]
+
+    covered, popped, release = 0.0, 0, 1
+    while frontier:
+        lp, indices, items = heapq.heappop(frontier)
+
+        # Only the configurations following the lowest index in use can still be
+        # requested, the others are discarded each time the number of peaks doubles
+        popped += 1
+        if popped == release:
+            release *= 2
+            for i, block in enumerate(blocks):
+                block.release(min([indices[i]] + [entry[1][i] for entry in frontier]))
+
+        abbundance = exp(-lp)
+        yield [sum(item[1] for item in items), 100 * abbundance]
+
+        covered += abbundance
+        if covered >= coverage:
+            return
+
+        last = max((i for i, index in enumerate(indices) if index != 0), default=0)
+        for i in range(last, len(blocks)):
+            item = blocks[i].get(indices[i] + 1)
+            if item is None:
+                continue
+
+            new_indices = indices[:i] + (indices[i] + 1,) + indices[i + 1 :]
+            new_items = items[:i] + [item] + items[i + 1 :]
+            heapq.heappush(
+                frontier, (lp + items[i][0] - item[0], new_indices, new_items)
+            )
+
+
+def aggregated(
+    composition: List[List[Union[str, int]]],
+    bin_width: float = 1.0,
+    dump: float = 1e-12,
+    normalize: bool = False,
+    table: Optional[IsotopeTable] = None,
+) -> List[List[float]]:
+    """
+    Compute the aggregated isotope pattern of a molecule on a grid of mass bins. The
+    isotopes of each element are mapped onto the grid and the spectrum of each element
+    block is obtained raising the element spectrum to the number of atoms in Fourier space.
+    The mass of each bin is the abbundance weighted average of the masses it contains. The
+    cost does not depend on the number of fine structure peaks and can be used for molecules
+    with thousands of atoms. Requires NumPy.
+
+    Arguments
+    ---------
+    composition: List[List[Union[str, int]]]
+        The list of lists encoding the composition of the molecule.
+    bin_width: float
+        The width of the mass bins in a.m.u. (default: 1.0, nominal mass resolution).
+    dump: float
+        The probability threshold under which a bin is discarded.
+    normalize: bool
+        If set to False (default) will return the percentage abbundance else it will
+        set the largest peak to 100.
+    table: Optional[IsotopeTable]
+        The isotope table to use. If None (default) the table built from `ISOTOPES` is used.
+
+    Returns
+    -------
+    List[List[float]]
+        The list of lists encoding the mass and abbundance of each bin sorted by mass.
+    """
+    import numpy as np
+
+    # Group the blocks of the same element together
+    counts = {}
+    for element, number in composition:
+        if number != 0:
+            counts[element] = counts.get(element, 0) + number
+
+    if counts == {}:
+        raise ValueError("The composition does not contain any atom")
+
+    # Map the isotopes of each element on the grid starting from the lightest one
+    table = get_table(table)
+    origin, length, grids = 0.0, 1, []
+    for element, number in counts.items():
+        masses = np.frombuffer(table[element].masses)
+        abbundances = np.frombuffer(table[element].probabilities)
+
+        lightest = masses.min()
+        indices = np.rint((masses - lightest) / bin_width).astype(int)
+        deviations = masses - lightest - indices * bin_width
+
+        origin += number * lightest
+        length += number * indices.max()
+        grids.append((number, indices, abbundances, deviations))
+
+    # Raise the spectrum of each element to the number of atoms in Fourier space while
+    # propagating the abbundance weighted deviation of the masses from the grid points
+    spectra, powers, derivatives = [], [], []
+    for number, indices, abbundances, deviations in grids:
+        spectrum = np.zeros(length)
+        weighted = np.zeros(length)
+        np.add.at(spectrum, indices, abbundances)
+        np.add.at(weighted, indices, abbundances * deviations)
+
+        spectrum, weighted = np.fft.rfft(spectrum), np.fft.rfft(weighted)
+        spectra.append(spectrum**number)
+        powers.append(spectrum ** (number - 1))
+        derivatives.append(number * weighted)
+
+    total = np.prod(spectra, axis=0)
+    weighted = np.zeros_like(total)
+    for i, derivative in enumerate(derivatives):
+        others = np.prod(spectra[:i] + spectra[i + 1 :], axis=0)
+        weighted += derivative * powers[i] * others
+
+    abbundances = np.fft.irfft(total, n=length)
+    weighted = np.fft.irfft(weighted, n=length)
+
+    # Drop the bins below the dump threshold (including the FFT round-off noise)
+    kept = np.flatnonzero((abbundances >= dump) & (abbundances > 0))
+    masses = origin + kept * bin_width + weighted[kept] / abbundances[kept]
+    abbundances = 100 * abbundances[kept]
+
+    if normalize is True:
+        abbundances *= 100 / abbundances.max()
+
+    return np.column_stack((masses, abbundances)).tolist()
+
+
+def plot_peaks(
+    masses: List[float],
+    intensities: List[float],
+    filename: Optional[str] = None,
+    show: bool = True,
+    profile: Optional[Tuple[Sequence[float], Sequence[float]]] = None,
+) -> None:
+    """
+    Plot the stick spectrum of an isotope pattern. Matplotlib is imported only when this
+    function is called, so that the rest of the module can be used without paying its
+    import cost.
+
+    Arguments
+    ---------
+    masses: List[float]
+        The masses of the peaks.
+    intensities: List[float]
+        The intensities of the peaks (normalized so that the largest one is 100).
+    filename: Optional[str]
+        If given, the path of the file in which the plot is saved.
+    show: bool
+        If set to True (default) the plot is shown in an interactive window.
+    profile: Optional[Tuple[Sequence[float], Sequence[float]]]
+        If given, the m/z grid and the intensities of a profile spectrum (see the
+        `spectrum` module) plotted instead of the sticks.
+    """
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(8, 5))
+
+    if profile is None:
+        plt.stem(masses, intensities, basefmt="none", markerfmt="none")
+    else:
+        plt.plot(*profile, linewidth=0.8)
+    plt.ylim([0, 105])
+
+    plt.xlabel("Mass [amu]")
+    plt.ylabel("Intensity [a.u.]")
+
+    if filename is not None:
+        plt.savefig(filename, dpi=600)
+
+    if show:
+        plt.show()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(
+        description="Compute the isotope pattern of a compound from its brute formula."
+    )
+    parser.add_argument(
+        "formula", nargs="?", help="brute formula (asked interactively if not given)"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="save the table of peaks in the given .csv file, .npz archive or directory "
+        "of .npy files (requires numpy)",
+    )
+    parser.add_argument(
+        "--no-plot",
+        action="store_true",
+        help="do not plot the spectrum (matplotlib is never imported)",
+    )
+    parser.add_argument(
+        "--bin-width",
+        type=float,
+        help="compute the aggregated pattern on mass bins of the given width",
+    )
+    parser.add_argument(
+        "--backend", choices=["python", "numpy", "auto"], default="python"
+    )
+    parser.add_argument(
+        "--coverage", type=float, default=1.0, help="minimum probability coverage"
+    )
+    parser.add_argument(
+        "--max-peaks", type=int, help="maximum number of peaks kept at each step"
+    )
+    parser.add_argument(
+        "--resolution",
+        type=float,
+        help="simulate a profile spectrum at the given resolving power and list the "
+        "peaks observed at that resolution",
+    )
+    parser.add_argument(
+        "--shape", choices=["gaussian", "lorentzian"], default="gaussian"
+    )
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="only print the monoisotopic, nominal and average mass and the standard "
+        "deviation of the isotope distribution",
+    )
+    parser.add_argument(
+        "--adducts",
+        nargs="+",
+        metavar="SPECIES",
+        help="compute the m/z patterns of the given ion species (e.g. '[M+H]+' "
+        "'[M-H]-', or 'positive'/'negative' for the common ESI ions) from the neutral "
+        "formula (requires numpy)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print the timing and the statistics of each convolution step",
+    )
+    args = parser.parse_args(argv)
+
+    if args.adducts is not None:
+        for option in ("summary", "bin_width", "resolution", "profile"):
+            if getattr(args, option) not in (None, False):
+                name = option.replace("_", "-")
+                parser.error(f"argument --{name} cannot be used with --adducts")
+
+    formula = args.formula
+    if formula is None:
+        formula = input("Enter the brute formula of the compound: ")
+
+    composition = parse_formula(formula)
+    if args.summary:
+        summary = mass_summary(composition)
+        print(f"Monoisotopic mass: {summary.monoisotopic:.6f} amu")
+        print(f"Nominal mass: {summary.nominal} amu")
+        print(f"Average mass: {summary.average:.6f} amu")
+        print(f"Standard deviation: {summary.variance ** 0.5:.6f} amu")
+        return
+
+    if args.adducts is not None:
+        import adducts
+
+        species = []
+        for name in args.adducts:
+            if name in ("positive", "negative"):
+                species.extend(getattr(adducts, name.upper()))
+            else:
+                species.append(name)
+
+        ions = adducts.adduct_patterns(
+            composition,
+            species,
+            normalize=True,
+            backend=args.backend,
+            coverage=args.coverage,
+            max_peaks=args.max_peaks,
+        )
+        print("\n" + adducts.format_table(ions))
+
+        if args.output is not None:
+            adducts.save(args.output, ions)
+
+        if not args.no_plot:
+            masses = [mz for ion in ions for mz in ion.peaks[:, 0].tolist()]
+            intensities = [i for ion in ions for i in ion.peaks[:, 1].tolist()]
+            plot_peaks(masses, intensities, f"adducts_{formula}.png")
+        return
+
+    if args.bin_width is None:
+        profiler = Profiler() if args.profile else None
+        peaks, report = process(
+            composition,
+            normalize=True,
+            backend=args.backend,
+            cache=not args.profile,
+            coverage=args.coverage,
+            max_peaks=args.max_peaks,
+            report=True,
+            profiler=profiler,
+        )
+        if report.discarded > 1e-6:
+            print(f"Discarded probability: {100 * report.discarded:.4f}%")
+        if profiler is not None:
+            print(profiler.report())
+    else:
+        peaks = aggregated(composition, bin_width=args.bin_width, normalize=True)
+
+    curve = None
+    if args.resolution is not None:
+        import spectrum
+
+        curve = spectrum.profile(peaks, args.resolution, args.shape)
+        peaks = spectrum.centroid(*curve, shape=args.shape)
+
+    masses = [peak[0] for peak in peaks]
+    intensities = [peak[1] for peak in peaks]
+
+    print("\n  Mass (amu) | Intensity  ")
+    print("--------------------------")
+    for mass, intensity in zip(masses, intensities):
+        print("{0:>12} | {1:>6}".format(f"{mass:.6f}", f"{intensity:.4e}"))
+
+    if args.output is not None:
+        if args.output.endswith(".csv"):
+            with open(args.output, "w", buffering=1024**2) as csv:
+                csv.write(
+                    "".join(
+                        f"{mass:.10f}, {intensity:.10f}\n"
+                        for mass, intensity in zip(masses, intensities)
+                    )
+                )
+        else:
+            import export
+
+            export.save(args.output, formula, masses, intensities)
+
+    if not args.no_plot:
+        plot_peaks(masses, intensities, f"exact_mass_{formula}.png", profile=curve)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import json
+import os
+import sqlite3
+import sys
+import time
+from argparse import ArgumentParser
+from array import array
+from typing import Any, Dict, List, Optional, Union
+
+import isomol
+
+# The default maximum size of the stored patterns (256 MB)
+MAX_BYTES = 256 * 1024**2
+
+# The minimum interval in seconds between two updates of the access time of a pattern, so
+# that repeated reads of the same pattern do not require a write each
+ACCESS_RESOLUTION = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patterns (
+    key TEXT PRIMARY KEY,
+    peaks BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS patterns_accessed ON patterns (accessed);
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER);
+INSERT OR IGNORE INTO totals VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS patterns_insert AFTER INSERT ON patterns BEGIN
+    UPDATE totals SET size = size + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS patterns_update AFTER UPDATE OF size ON patterns BEGIN
+    UPDATE totals SET size = size - old.size + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS patterns_delete AFTER DELETE ON patterns BEGIN
+    UPDATE totals SET size = size - old.size;
+END;
+"""
+
+
+def pack(peaks: List[List[float]]) -> bytes:
+    """
+    Encode a list of peaks as the bytes of an array of doubles alternating masses and
+    intensities.
+    """
+    return array("d", [value for peak in peaks for value in peak]).tobytes()
+
+
+def unpack(data: bytes) -> List[List[float]]:
+    """
+    Decode the peaks encoded by `pack`.
+    """
+    values = array("d")
+    values.frombytes(data)
+    return [[values[i], values[i + 1]] for i in range(0, len(values), 2)]
+
+
+class ResultCache:
+    """
+    Persistent cache of the patterns computed by `isomol.process`, stored in an SQLite
+    database so that they are shared across restarts and across worker processes. The
+    database is opened in WAL mode, allowing concurrent readers while a process writes,
+    and each process uses its own connection, opened on first use. When the size of the
+    stored patterns, kept up to date by triggers, exceeds `max_bytes` the least recently
+    used ones are evicted.
+
+    Arguments
+    ---------
+    path: str
+        The path of the database file (created if it does not exist).
+    max_bytes: Optional[int]
+        The maximum size in bytes of the stored patterns (default: 256 MB). If set to None
+        the size is not limited.
+    timeout: float
+        The time in seconds a process waits for the database to be unlocked by another
+        writer before raising an error (default: 30).
+    """
+
+    def __init__(
+        self, path: str, max_bytes: Optional[int] = MAX_BYTES, timeout: float = 30.0
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.__connection = None
+        self.__pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self.__connection is None or self.__pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute(f"PRAGMA busy_timeout = {int(1000 * self.timeout)}")
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self.__connection, self.__pid = connection, os.getpid()
+
+        return self.__connection
+
+    @staticmethod
+    def key(
+        composition: List[List[Union[str, int]]],
+        equivalent: float = 1e-8,
+        dump: float = 1e-12,
+        normalize: bool = False,
+        absolute: bool = False,
+        coverage: float = 1.0,
+        max_peaks: Optional[int] = None,
+        table: Optional[isomol.IsotopeTable] = None,
+    ) -> str:
+        """
+        Build the key of a pattern from the canonical formula of the composition, the
+        options affecting the result and the fingerprint of the isotope table.
+        """
+        return json.dumps(
+            [
+                isomol.format_formula(composition),
+                equivalent,
+                dump,
+                normalize,
+                absolute,
+                coverage,
+                max_peaks,
+                isomol.get_table(table).fingerprint,
+            ]
+        )
+
+    def get(self, key: str) -> Optional[List[List[float]]]:
+        """
+        Return the pattern stored for the given key or None if the key is not in the cache.
+        """
+        row = self.connection.execute(
+            "SELECT peaks, accessed FROM patterns WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        now = time.time()
+        if now - row[1] > ACCESS_RESOLUTION:
+            self.connection.execute(
+                "UPDATE patterns SET accessed = ? WHERE key = ?", (now, key)
+            )
+
+        return unpack(row[0])
+
+    def put(self, key: str, peaks: List[List[float]]) -> None:
+        """
+        Store a pattern in the cache evicting the least recently used ones if the cache is
+        larger than its maximum size.
+        """
+        data = pack(peaks)
+        self.connection.execute(
+            "INSERT INTO patterns VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+            "peaks = excluded.peaks, size = excluded.size, accessed = excluded.accessed",
+            (key, data, len(data), time.time()),
+        )
+
+        if self.max_bytes is not None and self.size() > self.max_bytes:
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes: int) -> int:
+        """
+        Remove the least recently used patterns until their size is below 90% of the given
+        limit, so that the eviction is not repeated at every insertion.
+
+        Returns
+        -------
+        int
+            The number of patterns removed.
+        """
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            excess = self.size() - int(0.9 * max_bytes)
+            keys = []
+            for key, size in connection.execute(
+                "SELECT key, size FROM patterns ORDER BY accessed"
+            ):
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= size
+
+            connection.executemany("DELETE FROM patterns WHERE key = ?", keys)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        connection.execute("COMMIT")
+        return len(keys)
+
+    def size(self) -> int:
+        """
+        Return the total size in bytes of the stored patterns.
+        """
+        return self.connection.execute("SELECT size FROM totals").fetchone()[0]
+
+    def count(self) -> int:
+        """
+        Return the number of stored patterns.
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM patterns").fetchone()[0]
+
+    def clear(self) -> None:
+        """
+        Remove all the stored patterns and reset the statistics.
+        """
+        self.connection.execute("DELETE FROM patterns")
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a dictionary with the hit/miss statistics of this process and the size of
+        the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "patterns": self.count(),
+            "bytes": self.size(),
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self) -> None:
+        if self.__connection is not None and self.__pid == os.getpid():
+            self.__connection.close()
+        self.__connection = None
+
+
+# The caches opened by this process, shared by all the calls to `open_cache`
+_OPEN_CACHES = {}
+
+
+def open_cache(
+    path: str, max_bytes: Optional[int] = MAX_BYTES, timeout: float = 30.0
+) -> ResultCache:
+    """
+    Return the `ResultCache` stored at the given path, opening it only once per process so
+    that worker processes handling many tasks reuse the same connection.
+    """
+    key = (os.path.abspath(path), max_bytes, timeout)
+    if key not in _OPEN_CACHES:
+        _OPEN_CACHES[key] = ResultCache(path, max_bytes, timeout)
+
+    return _OPEN_CACHES[key]
+
+
+def process(
+    composition: List[List[Union[str, int]]], cache: ResultCache, **options
+) -> List[List[float]]:
+    """
+    Compute the isotope pattern of a composition with `isomol.process`, returning the one
+    stored in the persistent cache if available and storing it otherwise.
+
+    Arguments
+    ---------
+    composition: List[List[Union[str, int]]]
+        The composition of the molecule.
+    cache: ResultCache
+        The persistent cache.
+    **options
+        The keyword arguments passed to `isomol.process` (the `backend` and `cache`
+        options do not affect the result and are not part of the key). The `report`
+        option is not supported since the report is not stored in the cache.
+
+    Returns
+    -------
+    List[List[float]]
+        The list of lists encoding the mass and abbundance of each peak.
+    """
+    if options.get("report", False):
+        raise ValueError("The pruning report is not available for cached patterns")
+
+    options.pop("report", None)
+    key = cache.key(
+        composition,
+        **{
+            name: value
+            for name, value in options.items()
+            if name not in ("backend", "cache", "progress", "profiler")
+        },
+    )
+
+    peaks = cache.get(key)
+    if peaks is None:
+        peaks = isomol.process(composition, **options)
+        cache.put(key, peaks)
+
+    return peaks
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(description="Inspect or clear a persistent pattern cache.")
+    parser.add_argument("path", help="path of the cache database")
+    parser.add_argument(
+        "--clear", action="store_true", help="remove all the stored patterns"
+    )
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.path, max_bytes=None)
+    if args.clear:
+        cache.clear()
+
+    stats = cache.stats()
+    print(f"{stats['patterns']} patterns, {stats['bytes'] / 1024**2:.2f} MB")
+    cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
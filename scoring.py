@@ -0,0 +1,332 @@
+import sys
+from argparse import ArgumentParser
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+import isomol
+
+# The theoretical patterns already computed, shared by all the scoring calls
+PATTERNS = isomol.PatternCache(maxsize=1024)
+
+
+class Score(NamedTuple):
+    """
+    The similarity between the isotope pattern of a candidate and an observed spectrum.
+
+    Attributes
+    ----------
+    formula: str
+        The canonical formula of the candidate.
+    cosine: float
+        The cosine similarity (0 to 1) between the theoretical and observed intensities.
+    chi2: float
+        The chi-squared distance between the normalized theoretical and observed
+        intensities (0 for a perfect match).
+    weighted: float
+        The cosine similarity in which each matched pair is weighted by a Gaussian of its
+        mass error, with standard deviation equal to the tolerance.
+    matched: float
+        The fraction (0 to 1) of the theoretical intensity matched by an observed peak.
+    error: float
+        The intensity-weighted mean mass error of the matched peaks (in ppm, or in a.m.u. if
+        the tolerance is absolute).
+    """
+
+    formula: str
+    cosine: float
+    chi2: float
+    weighted: float
+    matched: float
+    error: float
+
+
+def pattern(
+    candidate: Union[str, List[list]],
+    threshold: float = 1e-3,
+    table: Optional[isomol.IsotopeTable] = None,
+    **options,
+) -> Tuple[str, np.ndarray]:
+    """
+    Return the theoretical pattern of a candidate as a sorted (n, 2) array of m/z values and
+    intensities normalized to unit sum, discarding the peaks below a relative threshold.
+    The patterns are stored in `PATTERNS` so that candidates shared by several spectra are
+    computed only once.
+
+    Arguments
+    ---------
+    candidate: Union[str, List[List[Union[str, int]]]]
+        The formula of the candidate, eventually carrying a charge (e.g. `C6H13O6+`), or
+        the composition of a neutral molecule.
+    threshold: float
+        The minimum intensity of a peak relative to the most intense one (default: 1e-3).
+    table: Optional[isomol.IsotopeTable]
+        The isotope table to use. If None the default one is used.
+    **options
+        The keyword arguments passed to `isomol.process`.
+
+    Returns
+    -------
+    Tuple[str, np.ndarray]
+        The canonical formula of the candidate and its pattern.
+    """
+    if isinstance(candidate, str):
+        composition, charge = isomol.parse_ion(candidate)
+    else:
+        composition, charge = candidate, 0
+
+    formula = isomol.format_formula(composition, charge)
+    table = isomol.get_table(table)
+    key = (formula, threshold, tuple(sorted(options.items())), table.fingerprint)
+
+    peaks = PATTERNS.get(key)
+    if peaks is None:
+        peaks = np.array(
+            isomol.process(composition, table=table, **options), dtype=float
+        )
+        peaks = peaks[peaks[:, 1] >= threshold * peaks[:, 1].max()]
+        peaks = peaks[np.argsort(peaks[:, 0])]
+        peaks[:, 1] /= peaks[:, 1].sum()
+
+        if charge != 0:
+            peaks[:, 0] = (peaks[:, 0] - charge * isomol.ELECTRON_MASS) / abs(charge)
+
+        peaks.setflags(write=False)
+        PATTERNS.put(key, peaks)
+
+    return formula, peaks
+
+
+def match(
+    theoretical: np.ndarray,
+    observed: np.ndarray,
+    tolerance: float = 5.0,
+    absolute: bool = False,
+) -> np.ndarray:
+    """
+    Match each theoretical mass with the nearest observed one by binary search.
+
+    Arguments
+    ---------
+    theoretical: np.ndarray
+        The theoretical masses.
+    observed: np.ndarray
+        The observed masses sorted in increasing order.
+    tolerance: float
+        The maximum mass error in ppm (default: 5) or in a.m.u. if `absolute` is True.
+    absolute: bool
+        If set to True the tolerance is an absolute value in a.m.u.
+
+    Returns
+    -------
+    np.ndarray
+        The index of the observed peak matched by each theoretical one or -1 if no
+        observed peak is found within the tolerance.
+    """
+    if observed.size == 0:
+        return np.full(theoretical.size, -1)
+
+    right = np.clip(np.searchsorted(observed, theoretical), 1, observed.size - 1)
+    left = right - 1
+    if observed.size == 1:
+        right = left = np.zeros_like(right)
+
+    nearest = np.where(
+        np.abs(observed[left] - theoretical) <= np.abs(observed[right] - theoretical),
+        left,
+        right,
+    )
+    window = tolerance if absolute else theoretical * tolerance * 1e-6
+    return np.where(np.abs(observed[nearest] - theoretical) <= window, nearest, -1)
+
+
+def score_candidates(
+    candidates: Iterable[Union[str, List[list]]],
+    observed: List[List[float]],
+    tolerance: float = 5.0,
+    absolute: bool = False,
+    threshold: float = 1e-3,
+    table: Optional[isomol.IsotopeTable] = None,
+    **options,
+) -> List[Score]:
+    """
+    Score the isotope patterns of many candidates against an observed peak list. The
+    patterns of all the candidates are concatenated and matched against the observed peaks
+    with a single binary search, and the scores of every candidate are accumulated at once.
+    The theoretical peaks matching the same observed peak (e.g. the isotopic fine structure
+    not resolved by the instrument) are summed before being compared.
+
+    Arguments
+    ---------
+    candidates: Iterable[Union[str, List[List[Union[str, int]]]]]
+        The formulas (or compositions) of the candidates.
+    observed: List[List[float]]
+        The list of lists encoding the m/z and intensity of each observed peak.
+    tolerance: float
+        The maximum mass error in ppm (default: 5) or in a.m.u. if `absolute` is True.
+    absolute: bool
+        If set to True the tolerance is an absolute value in a.m.u.
+    threshold: float
+        The minimum relative intensity of the theoretical peaks compared (default: 1e-3).
+    table: Optional[isomol.IsotopeTable]
+        The isotope table to use. If None the default one is used.
+    **options
+        The keyword arguments passed to `isomol.process`.
+
+    Returns
+    -------
+    List[Score]
+        The scores of the candidates in the same order in which they are given.
+    """
+    formulas, patterns = [], []
+    for candidate in candidates:
+        formula, peaks = pattern(candidate, threshold, table, **options)
+        formulas.append(formula)
+        patterns.append(peaks)
+
+    if formulas == []:
+        return []
+
+    observed = np.asarray(observed, dtype=float).reshape(-1, 2)
+    observed = observed[np.argsort(observed[:, 0])]
+    om, oi = observed[:, 0], observed[:, 1]
+
+    # Concatenate the patterns keeping track of the candidate owning each peak
+    n = len(patterns)
+    sizes = np.array([peaks.shape[0] for peaks in patterns])
+    owner = np.repeat(np.arange(n), sizes)
+    tm = np.concatenate([peaks[:, 0] for peaks in patterns])
+    ti = np.concatenate([peaks[:, 1] for peaks in patterns])
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+
+    # Normalize the observed peaks falling in the mass window of each candidate
+    window = np.full(tm.size, tolerance) if absolute else tm * tolerance * 1e-6
+    first, last = offsets[:-1], offsets[1:] - 1
+    low = np.searchsorted(om, tm[first] - window[first], "left")
+    high = np.searchsorted(om, tm[last] + window[last], "right")
+    cumulative = np.concatenate(([0.0], np.cumsum(oi)))
+    cumulative2 = np.concatenate(([0.0], np.cumsum(oi**2)))
+    total = cumulative[high] - cumulative[low]
+    scale = np.divide(1, total, out=np.zeros(n), where=total > 0)
+    onorm2 = (cumulative2[high] - cumulative2[low]) * scale**2
+
+    # Sum the theoretical peaks matched by the same observed peak of the same candidate
+    nearest = match(tm, om, tolerance, absolute)
+    found = nearest >= 0
+    groups, inverse = np.unique(
+        owner[found] * om.size + nearest[found], return_inverse=True
+    )
+    gowner, gindex = np.divmod(groups, max(om.size, 1))
+    gi = np.bincount(inverse, weights=ti[found], minlength=groups.size)
+    gm = np.bincount(inverse, ti[found] * tm[found], groups.size) / gi
+    go = oi[gindex] * scale[gowner]
+
+    error = gm - om[gindex] if absolute else 1e6 * (gm - om[gindex]) / om[gindex]
+    gaussian = np.exp(-0.5 * (error / tolerance) ** 2)
+
+    # Accumulate the per-candidate sums over the matched groups and the unmatched peaks
+    lost = ~found
+    tnorm2 = np.bincount(gowner, gi**2, n) + np.bincount(owner[lost], ti[lost] ** 2, n)
+    dot = np.bincount(gowner, gi * go, n)
+    wdot = np.bincount(gowner, gi * go * gaussian, n)
+    chi2 = np.bincount(gowner, (go - gi) ** 2 / gi, n) + np.bincount(
+        owner[lost], ti[lost], n
+    )
+    matched = np.bincount(gowner, gi, n).astype(float)
+    mean_error = np.divide(
+        np.bincount(gowner, gi * error, n),
+        matched,
+        out=np.full(n, np.nan),
+        where=matched > 0,
+    )
+
+    norm = np.sqrt(tnorm2 * onorm2)
+    cosine = np.divide(dot, norm, out=np.zeros(n), where=norm > 0)
+    weighted = np.divide(wdot, norm, out=np.zeros(n), where=norm > 0)
+
+    return [
+        Score(*values)
+        for values in zip(
+            formulas,
+            cosine.tolist(),
+            chi2.tolist(),
+            weighted.tolist(),
+            matched.tolist(),
+            mean_error.tolist(),
+        )
+    ]
+
+
+def rank(scores: List[Score], key: str = "weighted") -> List[Score]:
+    """
+    Sort the scores from the best to the worst candidate according to one of the scores
+    (`cosine`, `chi2` or `weighted`).
+    """
+    if key not in ("cosine", "chi2", "weighted"):
+        raise ValueError(f"Unknown score '{key}'")
+
+    sign = 1 if key == "chi2" else -1
+    return sorted(scores, key=lambda score: sign * getattr(score, key))
+
+
+def read_peaks(path: str) -> List[List[float]]:
+    """
+    Read a peak list from a text file with the m/z and intensity of a peak on each line,
+    separated by spaces, tabs or commas. Lines that cannot be parsed (e.g. headers) are
+    skipped.
+    """
+    peaks = []
+    with open(path, "r") as stream:
+        for line in stream:
+            fields = line.replace(",", " ").split()
+            try:
+                peaks.append([float(fields[0]), float(fields[1])])
+            except (ValueError, IndexError):
+                continue
+
+    return peaks
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(
+        description="Rank candidate formulas against an observed peak list."
+    )
+    parser.add_argument("spectrum", help="file with the m/z and intensity of each peak")
+    parser.add_argument("candidates", nargs="+", help="candidate formulas")
+    parser.add_argument(
+        "--ppm", type=float, default=5.0, help="tolerance in ppm (default: 5)"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1e-3,
+        help="minimum relative intensity of the theoretical peaks (default: 1e-3)",
+    )
+    parser.add_argument(
+        "--sort",
+        choices=["cosine", "chi2", "weighted"],
+        default="weighted",
+        help="score used to rank the candidates (default: weighted)",
+    )
+    args = parser.parse_args(argv)
+
+    scores = score_candidates(
+        args.candidates, read_peaks(args.spectrum), args.ppm, threshold=args.threshold
+    )
+
+    print(
+        f"\n{'Formula':>20} | {'Cosine':>7} | {'Chi2':>9} | {'Weighted':>8} | "
+        f"{'Matched':>7} | Error (ppm)"
+    )
+    print("-" * 82)
+    for score in rank(scores, args.sort):
+        print(
+            f"{score.formula:>20} | {score.cosine:>7.4f} | {score.chi2:>9.3e} | "
+            f"{score.weighted:>8.4f} | {score.matched:>7.3f} | {score.error:.3f}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+import re
+import sys
+from argparse import ArgumentParser
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import isomol
+
+# Default element ranges used by the search (common organic molecules)
+DEFAULT_ELEMENTS = {"C": (0, 60), "H": (0, 120), "N": (0, 10), "O": (0, 20)}
+
+# Valences used to compute the ring/double-bond equivalents (elements not listed are
+# treated as divalent and do not contribute)
+VALENCES = {
+    "H": 1,
+    "F": 1,
+    "Cl": 1,
+    "Br": 1,
+    "I": 1,
+    "Li": 1,
+    "Na": 1,
+    "K": 1,
+    "B": 3,
+    "N": 3,
+    "P": 3,
+    "As": 3,
+    "C": 4,
+    "Si": 4,
+    "Ge": 4,
+    "Sn": 4,
+}
+
+# Maximum number of entries of a precomputed mass index
+INDEX_LIMIT = 2_000_000
+
+
+class Candidate(NamedTuple):
+    """
+    A brute formula compatible with the observed mass.
+
+    Attributes
+    ----------
+    formula: str
+        The canonical brute formula.
+    composition: List[List[Union[str, int]]]
+        The composition of the molecule.
+    mass: float
+        The monoisotopic mass of the molecule (or the m/z of the ion).
+    error: float
+        The error with respect to the observed mass in ppm.
+    rdbe: float
+        The ring/double-bond equivalents.
+    """
+
+    formula: str
+    composition: list
+    mass: float
+    error: float
+    rdbe: float
+
+
+def monoisotopic_masses(
+    table: Optional[isomol.IsotopeTable] = None,
+) -> Dict[str, float]:
+    """
+    Return the monoisotopic mass (the mass of the most abundant isotope) of each element.
+    """
+    table = isomol.get_table(table)
+    return {element: table[element].masses[0] for element in table}
+
+
+def rdbe(composition: List[list]) -> float:
+    """
+    Compute the ring/double-bond equivalents of a composition.
+
+    Arguments
+    ---------
+    composition: List[List[Union[str, int]]]
+        The composition of the molecule.
+
+    Returns
+    -------
+    float
+        The number of rings plus double bonds.
+    """
+    return 1 + sum(n * (VALENCES.get(e, 2) - 2) for e, n in composition) / 2
+
+
+class MassIndex:
+    """
+    Sorted index of the monoisotopic masses of all the compositions of a subset of elements
+    within the given ranges. A query returns all the compositions whose mass falls in a
+    window with a binary search on the sorted masses.
+
+    Arguments
+    ---------
+    elements: Tuple[Tuple[str, int, int], ...]
+        The (element, minimum, maximum) ranges of the indexed elements.
+    table: Optional[isomol.IsotopeTable]
+        The isotope table from which the monoisotopic masses are taken.
+    """
+
+    def __init__(
+        self,
+        elements: Tuple[Tuple[str, int, int], ...],
+        table: Optional[isomol.IsotopeTable] = None,
+    ) -> None:
+        monoisotopic = monoisotopic_masses(table)
+
+        self.elements = [element for element, _, _ in elements]
+        axes = [np.arange(lo, hi + 1) for _, lo, hi in elements]
+        counts = np.stack(
+            [grid.ravel() for grid in np.meshgrid(*axes, indexing="ij")], axis=1
+        )
+        masses = counts @ np.array([monoisotopic[e] for e in self.elements])
+
+        order = np.argsort(masses)
+        self.masses = masses[order]
+        self.counts = counts[order]
+
+    def __len__(self) -> int:
+        return self.masses.size
+
+    @property
+    def minimum(self) -> float:
+        return float(self.masses[0])
+
+    @property
+    def maximum(self) -> float:
+        return float(self.masses[-1])
+
+    def query(self, low: float, high: float) -> np.ndarray:
+        """
+        Return the counts of the compositions with mass in the [low, high] interval.
+        """
+        start = np.searchsorted(self.masses, low, side="left")
+        stop = np.searchsorted(self.masses, high, side="right")
+        return self.counts[start:stop]
+
+
+# The mass indexes already built, shared by all the searches
+INDEXES = isomol.PatternCache(maxsize=32)
+
+
+def build_index(
+    elements: Tuple[Tuple[str, int, int], ...],
+    table: Optional[isomol.IsotopeTable] = None,
+) -> MassIndex:
+    """
+    Return the `MassIndex` of a subset of elements, reusing the ones already built so that
+    repeated queries over the same element ranges do not rebuild it.
+    """
+    key = (elements, isomol.get_table(table).fingerprint)
+
+    index = INDEXES.get(key)
+    if index is None:
+        index = MassIndex(elements, table)
+        INDEXES.put(key, index)
+
+    return index
+
+
+def search(
+    mass: float,
+    tolerance: float = 5.0,
+    elements: Optional[Dict[str, Tuple[int, int]]] = None,
+    charge: int = 0,
+    rdbe_range: Optional[Tuple[float, float]] = None,
+    ratios: Optional[Dict[Tuple[str, str], Tuple[float, float]]] = None,
+    table: Optional[isomol.IsotopeTable] = None,
+) -> List[Candidate]:
+    """
+    Find all the brute formulas whose monoisotopic mass matches an observed mass within a
+    tolerance in ppm. The heaviest elements are enumerated by branch-and-bound, pruning the
+    branches whose mass cannot be completed by the remaining elements, while the lightest
+    elements are looked up in a precomputed sorted mass index.
+
+    Arguments
+    ---------
+    mass: float
+        The observed mass (or m/z if `charge` is not zero).
+    tolerance: float
+        The tolerance in ppm (default: 5).
+    elements: Optional[Dict[str, Tuple[int, int]]]
+        The allowed (minimum, maximum) number of atoms of each element. If None the ranges
+        in `DEFAULT_ELEMENTS` are used.
+    charge: int
+        The charge of the observed ion. If not zero `mass` is the m/z of the ion generated by
+        the loss (or gain) of electrons.
+    rdbe_range: Optional[Tuple[float, float]]
+        If given, the allowed range of ring/double-bond equivalents.
+    ratios: Optional[Dict[Tuple[str, str], Tuple[float, float]]]
+        If given, the allowed range of the ratio between the number of atoms of two
+        elements, e.g. `{("H", "C"): (0.2, 3.1)}`.
+    table: Optional[isomol.IsotopeTable]
+        The isotope table from which the monoisotopic masses are taken.
+
+    Returns
+    -------
+    List[Candidate]
+        The candidates sorted by increasing absolute error.
+    """
+    elements = DEFAULT_ELEMENTS if elements is None else elements
+    monoisotopic = monoisotopic_masses(table)
+
+    # Convert the observed m/z in the mass of the neutral molecule
+    target = mass * abs(charge) + charge * isomol.ELECTRON_MASS if charge else mass
+    window = target * tolerance * 1e-6
+    low, high = target - window, target + window
+
+    # Index the lightest elements as long as the index remains small
+    ranges = sorted(
+        ((e, lo, hi) for e, (lo, hi) in elements.items()),
+        key=lambda item: -monoisotopic[item[0]],
+    )
+    size, split = 1, len(ranges)
+    while split > 0:
+        _, lo, hi = ranges[split - 1]
+        if size * (hi - lo + 1) > INDEX_LIMIT:
+            break
+        split -= 1
+        size *= hi - lo + 1
+
+    outer, inner = ranges[:split], tuple(ranges[split:])
+    index = build_index(inner, table) if inner else None
+
+    # Mass bounds of the elements following each level of the branch-and-bound
+    rest_min, rest_max = [0.0] * (len(outer) + 1), [0.0] * (len(outer) + 1)
+    if index is not None:
+        rest_min[-1], rest_max[-1] = index.minimum, index.maximum
+    for i in reversed(range(len(outer))):
+        element, lo, hi = outer[i]
+        rest_min[i] = rest_min[i + 1] + lo * monoisotopic[element]
+        rest_max[i] = rest_max[i + 1] + hi * monoisotopic[element]
+
+    names = [element for element, _, _ in outer]
+    candidates = []
+
+    def accept(counts: Dict[str, int]) -> None:
+        composition = [
+            [element, counts[element]]
+            for element in isomol.hill_order(counts)
+            if counts[element] != 0
+        ]
+        if composition == []:
+            return
+
+        value = rdbe(composition)
+        if rdbe_range is not None and not rdbe_range[0] <= value <= rdbe_range[1]:
+            return
+
+        for (numerator, denominator), (lo, hi) in (ratios or {}).items():
+            if counts.get(denominator, 0) != 0:
+                if not lo <= counts.get(numerator, 0) / counts[denominator] <= hi:
+                    return
+
+        observed = sum(n * monoisotopic[e] for e, n in composition)
+        if charge != 0:
+            observed = (observed - charge * isomol.ELECTRON_MASS) / abs(charge)
+
+        candidates.append(
+            Candidate(
+                isomol.format_formula(composition, charge),
+                composition,
+                observed,
+                1e6 * (observed - mass) / mass,
+                value,
+            )
+        )
+
+    def explore(level: int, partial: float, counts: List[int]) -> None:
+        if level == len(outer):
+            if index is None:
+                if low <= partial <= high:
+                    accept(dict(zip(names, counts)))
+                return
+
+            for row in index.query(low - partial, high - partial):
+                found = dict(zip(names, counts))
+                found.update(zip(index.elements, row.tolist()))
+                accept(found)
+            return
+
+        element, lo, hi = outer[level]
+        m = monoisotopic[element]
+        first = max(lo, int(np.ceil((low - partial - rest_max[level + 1]) / m)))
+        last = min(hi, int(np.floor((high - partial - rest_min[level + 1]) / m)))
+        for n in range(first, last + 1):
+            explore(level + 1, partial + n * m, counts + [n])
+
+    explore(0, 0.0, [])
+    candidates.sort(key=lambda candidate: abs(candidate.error))
+    return candidates
+
+
+def parse_range(text: str) -> Tuple[str, Tuple[int, int]]:
+    """
+    Parse an element range given as `C0-30` (from 0 to 30 atoms) or `C30` (up to 30 atoms).
+    """
+    match = re.fullmatch(r"([A-Z][a-z]?)(\d+)(?:-(\d+))?", text)
+    if match is None:
+        raise ValueError(f"Invalid element range '{text}'")
+
+    element, first, last = match.groups()
+    return element, (int(first), int(last)) if last is not None else (0, int(first))
+
+
+def parse_ratio(text: str) -> Tuple[Tuple[str, str], Tuple[float, float]]:
+    """
+    Parse an element ratio range given as `H/C=0.2-3.1` (from 0.2 to 3.1 hydrogen atoms per
+    carbon atom).
+    """
+    number = r"(\d+(?:\.\d*)?|\.\d+)"
+    match = re.fullmatch(rf"([A-Z][a-z]?)/([A-Z][a-z]?)={number}-{number}", text)
+    if match is None:
+        raise ValueError(f"Invalid element ratio range '{text}'")
+
+    numerator, denominator, lo, hi = match.groups()
+    return (numerator, denominator), (float(lo), float(hi))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(
+        description="Find the brute formulas compatible with an observed mass."
+    )
+    parser.add_argument("mass", type=float, help="observed mass (or m/z)")
+    parser.add_argument(
+        "--ppm", type=float, default=5.0, help="tolerance in ppm (default: 5)"
+    )
+    parser.add_argument(
+        "-e",
+        "--elements",
+        nargs="+",
+        default=[f"{e}{lo}-{hi}" for e, (lo, hi) in DEFAULT_ELEMENTS.items()],
+        help="allowed element ranges, e.g. C0-30 H0-60 N5 (default: %(default)s)",
+    )
+    parser.add_argument("-z", "--charge", type=int, default=0, help="ion charge")
+    parser.add_argument(
+        "--rdbe", type=float, nargs=2, metavar=("MIN", "MAX"), help="allowed RDBE range"
+    )
+    parser.add_argument(
+        "--ratio",
+        nargs="+",
+        default=[],
+        help="allowed element ratio ranges, e.g. H/C=0.2-3.1 N/C=0-1.3",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=50, help="maximum number of candidates printed"
+    )
+    args = parser.parse_args(argv)
+
+    elements = dict(parse_range(text) for text in args.elements)
+    ratios = dict(parse_ratio(text) for text in args.ratio)
+    candidates = search(
+        args.mass, args.ppm, elements, args.charge, args.rdbe, ratios or None
+    )
+
+    print(f"\n{'Formula':>20} | {'Mass (amu)':>12} | {'Error (ppm)':>11} | RDBE")
+    print("-" * 58)
+    for candidate in candidates[: args.limit]:
+        print(
+            f"{candidate.formula:>20} | {candidate.mass:>12.6f} | "
+            f"{candidate.error:>11.3f} | {candidate.rdbe:.1f}"
+        )
+
+    if len(candidates) > args.limit:
+        print(f"... {len(candidates) - args.limit} more candidates")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
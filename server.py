@@ -0,0 +1,387 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import isomol
+
+# The options of `isomol.process` accepted by the service with their types
+OPTIONS = {
+    "normalize": bool,
+    "equivalent": float,
+    "dump": float,
+    "absolute": bool,
+    "coverage": float,
+    "max_peaks": int,
+    "backend": str,
+}
+
+# The maximum size of the body of a request (16 MB)
+MAX_BODY = 16 * 1024**2
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def parse_options(values: Dict[str, Any]) -> Tuple[Tuple[str, Any], ...]:
+    """
+    Validate the options of a request, converting them to the expected types, and return
+    them as a sorted tuple of (name, value) couples that can be used as part of a key.
+    """
+    options = {}
+    for name, value in values.items():
+        if name not in OPTIONS:
+            raise HTTPError(400, f"Unknown option '{name}'")
+
+        kind = OPTIONS[name]
+        try:
+            if value is None and name == "max_peaks":
+                options[name] = None
+            elif kind is bool and isinstance(value, str):
+                options[name] = value.lower() in ("1", "true", "yes")
+            else:
+                options[name] = kind(value)
+        except (TypeError, ValueError):
+            raise HTTPError(400, f"Invalid value for option '{name}'")
+
+    return tuple(sorted(options.items()))
+
+
+def compute(
+    composition: List[List[Any]], options: Tuple[Tuple[str, Any], ...]
+) -> List[List[float]]:
+    """
+    Compute a pattern in a worker process.
+    """
+    return isomol.process(composition, **dict(options))
+
+
+def ready() -> bool:
+    """
+    Do nothing in a worker process, used to start the workers of the pool.
+    """
+    return True
+
+
+class Metrics:
+    """
+    Latency and throughput statistics of the service. The latencies of the most recent
+    requests are kept in a bounded window from which the percentiles are computed.
+
+    Arguments
+    ---------
+    window: int
+        The number of recent requests used to compute the latency percentiles and the
+        recent throughput (default: 1024).
+    """
+
+    def __init__(self, window: int = 1024) -> None:
+        self.started = time.monotonic()
+        self.requests = Counter()
+        self.statuses = Counter()
+        self.recent = deque(maxlen=window)
+        self.formulas = 0
+        self.computed = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+
+    def record(self, endpoint: str, status: int, elapsed: float) -> None:
+        self.requests[endpoint] += 1
+        self.statuses[status] += 1
+        self.recent.append((time.monotonic(), elapsed))
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        uptime = now - self.started
+        latencies = sorted(elapsed for _, elapsed in self.recent)
+
+        def percentile(q):
+            if latencies == []:
+                return None
+            return 1000 * latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+        span = now - self.recent[0][0] if self.recent else 0
+        return {
+            "uptime": uptime,
+            "requests": sum(self.requests.values()),
+            "endpoints": dict(self.requests),
+            "statuses": {str(status): n for status, n in self.statuses.items()},
+            "formulas": self.formulas,
+            "computed": self.computed,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "throughput": sum(self.requests.values()) / uptime if uptime > 0 else 0,
+            "recent_throughput": len(self.recent) / span if span > 0 else 0,
+            "latency_ms": {
+                "p50": percentile(0.5),
+                "p90": percentile(0.9),
+                "p99": percentile(0.99),
+                "max": 1000 * latencies[-1] if latencies else None,
+            },
+        }
+
+
+class PatternService:
+    """
+    Asynchronous HTTP/JSON service computing isotope patterns in a pool of worker
+    processes. The patterns are stored in an in-memory cache and identical requests
+    arriving while a pattern is being computed wait for the same computation.
+
+    The endpoints are:
+    - `GET /pattern?formula=...&option=...` or `POST /pattern` with a JSON object
+      containing the `formula` and the options of `isomol.process`;
+    - `POST /batch` with a JSON object containing the list of `formulas` and the options;
+    - `GET /metrics` returning the latency and throughput statistics;
+    - `GET /health` returning the status of the service.
+
+    Arguments
+    ---------
+    workers: Optional[int]
+        The number of worker processes (default: the number of CPUs).
+    cache_size: Optional[int]
+        The maximum number of patterns kept in memory (default: 1024).
+    """
+
+    def __init__(
+        self, workers: Optional[int] = None, cache_size: Optional[int] = 1024
+    ) -> None:
+        # The workers are spawned instead of forked so that they do not inherit the sockets
+        # of the server and of the open connections, which would stay open in the workers
+        # after the server closes them
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = isomol.PatternCache(maxsize=cache_size)
+        self.metrics = Metrics()
+        self.__inflight = {}
+
+    async def pattern(
+        self, formula: str, options: Tuple[Tuple[str, Any], ...]
+    ) -> List[List[float]]:
+        """
+        Return the pattern of a formula, taken from the cache, from the computation of an
+        identical request in flight or computed in the worker pool.
+        """
+        composition = isomol.parse_formula(formula)
+        key = (isomol.format_formula(composition), options)
+        self.metrics.formulas += 1
+
+        peaks = self.cache.get(key)
+        if peaks is not None:
+            self.metrics.cache_hits += 1
+            return peaks
+
+        future = self.__inflight.get(key)
+        if future is not None:
+            self.metrics.coalesced += 1
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, compute, composition, options)
+        self.__inflight[key] = future
+        try:
+            peaks = await asyncio.shield(future)
+        finally:
+            del self.__inflight[key]
+
+        self.metrics.computed += 1
+        self.cache.put(key, peaks)
+        return peaks
+
+    async def route(
+        self, method: str, path: str, query: Dict[str, str], body: bytes
+    ) -> Dict[str, Any]:
+        if path == "/health":
+            return {"status": "ok"}
+
+        if path == "/metrics":
+            metrics = self.metrics.snapshot()
+            metrics["cache"] = self.cache.stats()
+            metrics["inflight"] = len(self.__inflight)
+            return metrics
+
+        if method == "POST":
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError:
+                raise HTTPError(400, "The body is not a valid JSON document")
+            if not isinstance(request, dict):
+                raise HTTPError(400, "The body must be a JSON object")
+        elif method == "GET":
+            request = dict(query)
+        else:
+            raise HTTPError(405, f"Method {method} not allowed")
+
+        if path == "/pattern":
+            formula = request.pop("formula", None)
+            if not isinstance(formula, str):
+                raise HTTPError(400, "Missing formula")
+
+            options = parse_options(request)
+            try:
+                peaks = await self.pattern(formula, options)
+            except (KeyError, ValueError) as error:
+                raise HTTPError(400, f"{type(error).__name__}: {error}")
+
+            return {"formula": formula, "peaks": peaks}
+
+        if path == "/batch":
+            if method != "POST":
+                raise HTTPError(405, "The batch endpoint requires a POST request")
+
+            formulas = request.pop("formulas", None)
+            if not isinstance(formulas, list):
+                raise HTTPError(400, "Missing list of formulas")
+
+            options = parse_options(request)
+            results = await asyncio.gather(
+                *(self.pattern(str(formula), options) for formula in formulas),
+                return_exceptions=True,
+            )
+
+            records = []
+            for formula, result in zip(formulas, results):
+                if isinstance(result, Exception):
+                    error = f"{type(result).__name__}: {result}"
+                    records.append({"formula": formula, "error": error})
+                else:
+                    records.append({"formula": formula, "peaks": result})
+
+            return {"results": records}
+
+        raise HTTPError(404, f"Unknown endpoint '{path}'")
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Serve the requests received on a connection, keeping it alive until the client
+        closes it or asks to close it.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                start = time.perf_counter()
+                method, target, version = line.decode("latin-1").split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                url = urlsplit(target)
+                length = int(headers.get("content-length", 0))
+
+                try:
+                    if length > MAX_BODY:
+                        raise HTTPError(413, "The request body is too large")
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = 200, await self.route(
+                        method, url.path, dict(parse_qsl(url.query)), body
+                    )
+                except HTTPError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except Exception as error:
+                    status, payload = 500, {"error": f"{type(error).__name__}: {error}"}
+
+                close = (
+                    headers.get("connection", "").lower() == "close"
+                    or version == "HTTP/1.0"
+                    or status == 413
+                )
+                data = json.dumps(payload).encode()
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(data)}\r\n"
+                        f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+                    ).encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+
+                self.metrics.record(url.path, status, time.perf_counter() - start)
+                if close:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        """
+        Serve the requests on the given address until cancelled.
+        """
+        # Start the workers before accepting connections, so that the first requests do not
+        # wait for them to be spawned
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self.executor, ready) for _ in range(self.workers))
+        )
+
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(description="HTTP/JSON isotope pattern service.")
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="address (default: %(default)s)"
+    )
+    parser.add_argument("--port", type=int, default=8000, help="port (default: 8000)")
+    parser.add_argument("-w", "--workers", type=int, help="number of worker processes")
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="number of patterns kept in memory (default: 1024)",
+    )
+    args = parser.parse_args(argv)
+
+    service = PatternService(args.workers, args.cache_size)
+    print(f"Serving on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
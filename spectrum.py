@@ -0,0 +1,165 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Half-width of the window around each peak, in units of its FWHM, used by default for
+# each peak shape (at this distance the Gaussian is below 1e-10 of its height while the
+# Lorentzian, having much wider tails, is below 1e-3). The peaks are tapered to reach zero
+# at the edge of the window, so that the truncation does not leave steps in the profile
+WINDOWS = {"gaussian": 3.0, "lorentzian": 16.0}
+
+
+def _shape(delta: np.ndarray, fwhm: np.ndarray, shape: str) -> np.ndarray:
+    """
+    Evaluate a peak shape of unit height at the given distances from its center.
+    """
+    x = (delta / fwhm) ** 2
+    if shape == "gaussian":
+        return np.exp(-4 * np.log(2) * x)
+    elif shape == "lorentzian":
+        return 1 / (1 + 4 * x)
+
+    raise ValueError(f"Unknown peak shape '{shape}'")
+
+
+def profile(
+    peaks: List[List[float]],
+    resolving_power: float,
+    shape: str = "gaussian",
+    points_per_fwhm: int = 10,
+    window: Optional[float] = None,
+    chunksize: int = 4096,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Render a stick spectrum as a profile spectrum at a given resolving power. Each stick is
+    replaced by a peak of the same height with full width at half maximum `m / R`, lowered
+    to reach zero at the edge of its window, and the peaks are summed on a uniform m/z
+    grid. Each peak is evaluated only on the grid points
+    of a window around its center, and the sticks are processed in vectorized chunks so that
+    tens of thousands of sticks can be rendered with bounded memory.
+
+    Arguments
+    ---------
+    peaks: List[List[float]]
+        The list of lists encoding the mass and intensity of each stick (e.g. the output
+        of `isomol.process`).
+    resolving_power: float
+        The resolving power `R = m / FWHM` of the simulated instrument.
+    shape: str
+        The peak shape: `gaussian` (default) or `lorentzian`.
+    points_per_fwhm: int
+        The number of grid points per FWHM of the narrowest peak (default: 10).
+    window: Optional[float]
+        The half-width of the window in which each peak is evaluated in units of FWHM. If
+        None a default suited to the peak shape is used.
+    chunksize: int
+        The number of sticks rendered at once.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The m/z grid and the profile intensity on each point of the grid.
+    """
+    if shape not in WINDOWS:
+        raise ValueError(f"Unknown peak shape '{shape}'")
+
+    window = WINDOWS[shape] if window is None else window
+
+    peaks = np.asarray(peaks, dtype=float).reshape(-1, 2)
+    masses, intensities = peaks[:, 0], peaks[:, 1]
+    if masses.size == 0:
+        return np.zeros(0), np.zeros(0)
+
+    fwhm = masses / resolving_power
+    half = window * fwhm
+
+    # The value of the peak shape at the edge of the window, subtracted from each peak so
+    # that its tails stay convex and continuous and the sum of the tails of many peaks
+    # never shows spurious maxima (the peaks are rescaled to keep their height)
+    edge = float(_shape(np.array(window), np.array(1.0), shape))
+
+    step = fwhm.min() / points_per_fwhm
+    start, stop = (masses - half).min(), (masses + half).max()
+    grid = start + step * np.arange(int(np.ceil((stop - start) / step)) + 1)
+
+    # Each peak covers at most `width` grid points starting from the first one inside its window
+    width = int(np.ceil(2 * half.max() / step)) + 2
+    offsets = np.arange(width)
+
+    spectrum = np.zeros(grid.size)
+    for begin in range(0, masses.size, chunksize):
+        chunk = slice(begin, begin + chunksize)
+        first = np.searchsorted(grid, masses[chunk] - half[chunk])
+
+        indices = first[:, None] + offsets
+        outside = indices >= grid.size
+        indices[outside] = grid.size - 1
+        delta = grid[indices] - masses[chunk, None]
+
+        values = intensities[chunk, None] * np.maximum(
+            (_shape(delta, fwhm[chunk, None], shape) - edge) / (1 - edge), 0
+        )
+        values[outside | (np.abs(delta) > half[chunk, None])] = 0
+
+        spectrum += np.bincount(
+            indices.ravel(), weights=values.ravel(), minlength=grid.size
+        )
+
+    return grid, spectrum
+
+
+def centroid(
+    grid: np.ndarray,
+    spectrum: np.ndarray,
+    threshold: float = 1e-6,
+    shape: str = "gaussian",
+) -> List[List[float]]:
+    """
+    Detect the peaks observable in a profile spectrum. Every local maximum above the
+    threshold is refined by fitting a parabola through the three points around it (on the
+    logarithm of the intensity for Gaussian peaks, for which the fit is exact).
+
+    Arguments
+    ---------
+    grid: np.ndarray
+        The uniform m/z grid of the profile spectrum.
+    spectrum: np.ndarray
+        The intensity of the profile spectrum on each point of the grid.
+    threshold: float
+        The minimum height of a peak relative to the most intense one (default: 1e-6).
+    shape: str
+        The peak shape used to render the profile: `gaussian` (default) or `lorentzian`.
+
+    Returns
+    -------
+    List[List[float]]
+        The list of lists encoding the mass and height of each observed peak.
+    """
+    if spectrum.size < 3:
+        return []
+
+    left, center, right = spectrum[:-2], spectrum[1:-1], spectrum[2:]
+    maxima = (
+        (center > left) & (center >= right) & (center >= threshold * spectrum.max())
+    )
+    indices = np.flatnonzero(maxima) + 1
+
+    y0, y1, y2 = spectrum[indices - 1], spectrum[indices], spectrum[indices + 1]
+    if shape == "gaussian" and np.all(y0 > 0) and np.all(y2 > 0):
+        y0, y1, y2 = np.log(y0), np.log(y1), np.log(y2)
+        logarithmic = True
+    else:
+        logarithmic = False
+
+    curvature = y0 - 2 * y1 + y2
+    shift = np.divide(
+        0.5 * (y0 - y2), curvature, out=np.zeros_like(y1), where=curvature != 0
+    )
+    heights = y1 - 0.25 * (y0 - y2) * shift
+    if logarithmic:
+        heights = np.exp(heights)
+
+    step = grid[1] - grid[0]
+    masses = grid[indices] + shift * step
+
+    return np.column_stack((masses, heights)).tolist()
@@ -0,0 +1,71 @@
+import math
+
+import pytest
+
+import isomol
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_negative_counts_are_rejected(backend):
+    with pytest.raises(ValueError):
+        isomol.process([["C", 6], ["H", -2]], backend=backend)
+
+    with pytest.raises(ValueError):
+        isomol.element_pattern("H", -1, backend=backend)
+
+    with pytest.raises(ValueError):
+        next(isomol.series([["H", -2]], [["C", 2], ["H", 4]], 3, backend=backend))
+
+    with pytest.raises(ValueError):
+        next(isomol.series([], [["C", 2], ["H", -4]], 3, backend=backend))
+
+
+def test_extend_rejects_negative_delta():
+    peaks = isomol.process([["C", 6], ["H", 12], ["O", 6]])
+    with pytest.raises(ValueError):
+        isomol.extend(peaks, [["H", -2]])
+
+
+def test_extend_matches_process():
+    peaks = isomol.process(isomol.parse_formula("C6H12O6"))
+    extended = isomol.extend(peaks, isomol.parse_formula("C6H10O5"))
+    reference = isomol.process(isomol.parse_formula("C12H22O11"))
+
+    significant = [value for peak in reference if peak[1] > 1e-6 for value in peak]
+    assert [
+        value for peak in extended if peak[1] > 1e-6 for value in peak
+    ] == pytest.approx(significant, rel=1e-9)
+
+
+def test_merge_groups_are_anchored_on_the_lightest_peak():
+    peaks = [[100.0, 1.0], [100.0 + 0.6e-6, 1.0], [100.0 + 1.2e-6, 1.0]]
+    merged = isomol.merge(peaks, equivalent=1e-8)
+    assert [peak[1] for peak in merged] == [2.0, 1.0]
+    assert merged[0][0] == pytest.approx(100.0 + 0.3e-6, rel=1e-12)
+
+
+def test_backends_merge_the_same_groups():
+    composition = isomol.parse_formula("C100H200N20O30S2")
+    python = isomol.process(composition, backend="python", cache=False)
+    numpy = isomol.process(composition, backend="numpy", cache=False)
+    assert len(python) == len(numpy)
+
+
+@pytest.mark.parametrize("element, number", [("Sn", 6), ("Hg", 8), ("S", 30)])
+def test_block_configurations_are_enumerated_once_in_order(element, number):
+    isotopes = isomol.get_table()[element]
+    items = list(isomol._iter_configurations(isotopes, number))
+
+    k = len(isotopes.masses)
+    assert len(items) == math.comb(number + k - 1, k - 1)
+    assert sum(math.exp(lp) for lp, _ in items) == pytest.approx(1.0, rel=1e-12)
+    assert all(a[0] >= b[0] - 1e-12 for a, b in zip(items, items[1:]))
+
+
+def test_iter_peaks_matches_process():
+    composition = isomol.parse_formula("SnCl4")
+    peaks = sorted(isomol.iter_peaks(composition))
+    reference = isomol.process(composition, dump=0)
+
+    assert len(peaks) == len(reference)
+    assert sum(peak[1] for peak in peaks) == pytest.approx(100.0)
@@ -0,0 +1,60 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(__file__)), "server.py")
+
+
+@pytest.fixture
+def address():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    process = subprocess.Popen(
+        [sys.executable, SERVER, "--port", str(port), "--workers", "2"],
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise
+                time.sleep(0.1)
+
+        yield "127.0.0.1", port
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def request(address, target):
+    with socket.create_connection(address, timeout=10) as connection:
+        connection.sendall(
+            f"GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode()
+        )
+
+        # The response must be followed by EOF, a timeout raises an error
+        data = b""
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                return data
+            data += chunk
+
+
+def test_connection_close_gets_eof(address):
+    first = request(address, "/pattern?formula=CCl4")
+    assert first.startswith(b"HTTP/1.1 200")
+    assert b"Connection: close" in first
+
+    second = request(address, "/pattern?formula=CH4")
+    assert second.startswith(b"HTTP/1.1 200")
@@ -0,0 +1,17 @@
+import pytest
+
+import isomol
+import spectrum
+
+
+@pytest.mark.parametrize("formula", ["C60", "CCl4", "C8H10N4O2"])
+@pytest.mark.parametrize("resolving_power", [5000, 20000, 100000])
+def test_lorentzian_centroids_match_gaussian(formula, resolving_power):
+    peaks = isomol.process(isomol.parse_formula(formula), normalize=True)
+
+    counts = {}
+    for shape in ("gaussian", "lorentzian"):
+        grid, curve = spectrum.profile(peaks, resolving_power, shape)
+        counts[shape] = len(spectrum.centroid(grid, curve, shape=shape))
+
+    assert counts["lorentzian"] == counts["gaussian"]